@@ -0,0 +1,192 @@
+# bench/contention_bench.py
+"""Many drivers racing to accept the same rides.
+
+Boots driver-service under gunicorn against a scratch database, seeds
+--rides pending rides and a driver per contender per ride, and for every
+ride fires --contenders accepts at once, each from a different driver, with
+up to --parallel rides contested at a time:
+
+    DB_HOST=localhost python bench/contention_bench.py --contenders 10 --rides 200
+
+Reports:
+- claims: rides some driver was told it won
+- conflicts: accepts answered 400
+- double assignments:
+  - rides more than one driver was told it won
+  - rides whose stored driver isn't the single winner
+  - drivers left marked busy without a ride
+- lock wait: backends of the scratch database seen waiting on a lock in
+  pg_stat_activity, sampled every --lock-sample-ms, as backend-seconds and
+  peak waiters; plus the mean time of the service's accept UPDATE from its
+  own db_query_duration_seconds
+- accept latency and throughput
+
+Exits 1 if any ride was double-assigned or an accept failed with anything
+other than 200 or 400.
+"""
+import argparse
+import asyncio
+import collections
+import math
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import psycopg2
+from prometheus_client.parser import text_string_to_metric_families
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stack  # noqa: E402
+from scratch_db import SERVER, scratch_database  # noqa: E402
+
+
+def seed(database, rides, drivers):
+    with psycopg2.connect(dbname=database, **SERVER) as conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO passengers (name) VALUES ('contention') RETURNING id")
+        passenger_id = cur.fetchone()[0]
+        cur.execute("INSERT INTO drivers (name) SELECT 'contention' FROM generate_series(1, %s) RETURNING id", (drivers,))
+        driver_ids = [row[0] for row in cur.fetchall()]
+        cur.execute("INSERT INTO rides (passenger_id, status) SELECT %s, 'pending' FROM generate_series(1, %s) RETURNING id",
+                    (passenger_id, rides))
+        ride_ids = [row[0] for row in cur.fetchall()]
+    conn.close()
+    return ride_ids, driver_ids
+
+
+class LockWaitSampler(threading.Thread):
+    """Counts the scratch database's backends waiting on heavyweight locks (row, transaction id) at a fixed interval."""
+
+    def __init__(self, database, interval):
+        super().__init__(name="lock-sampler", daemon=True)
+        self.database = database
+        self.interval = interval
+        self.stopping = threading.Event()
+        self.waiter_seconds = 0.0
+        self.peak = 0
+
+    def run(self):
+        conn = psycopg2.connect(dbname=self.database, **SERVER)
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            while not self.stopping.wait(self.interval):
+                cur.execute("SELECT COUNT(*) FROM pg_stat_activity WHERE datname = %s AND wait_event_type = 'Lock'",
+                            (self.database,))
+                waiting = cur.fetchone()[0]
+                self.waiter_seconds += waiting * self.interval
+                self.peak = max(self.peak, waiting)
+        conn.close()
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+
+async def contest(client, ride_ids, driver_ids, contenders, parallel):
+    results = []
+    slots = asyncio.Semaphore(parallel)
+
+    async def accept(ride_id, driver_id):
+        start = time.perf_counter()
+        try:
+            status = (await client.post(f"/accept_ride/{ride_id}", params={"driver_id": driver_id})).status_code
+        except httpx.TransportError:
+            status = 0
+        results.append((ride_id, driver_id, status, time.perf_counter() - start))
+
+    async def race(i, ride_id):
+        async with slots:
+            await asyncio.gather(*(accept(ride_id, driver_id)
+                                   for driver_id in driver_ids[i * contenders:(i + 1) * contenders]))
+
+    await asyncio.gather(*(race(i, ride_id) for i, ride_id in enumerate(ride_ids)))
+    return results
+
+
+def statement_means(metrics_text):
+    sums, counts = collections.Counter(), collections.Counter()
+    for family in text_string_to_metric_families(metrics_text):
+        if family.name == "db_query_duration_seconds":
+            for sample in family.samples:
+                if sample.name.endswith("_sum"):
+                    sums[sample.labels["statement"]] += sample.value
+                elif sample.name.endswith("_count"):
+                    counts[sample.labels["statement"]] += sample.value
+    return {statement: sums[statement] / counts[statement] * 1000 for statement in counts if counts[statement]}
+
+
+def verify(database, ride_ids, driver_ids, results):
+    winners = collections.defaultdict(list)
+    for ride_id, driver_id, status, _ in results:
+        if status == 200:
+            winners[ride_id].append(driver_id)
+    with psycopg2.connect(dbname=database, **SERVER) as conn, conn.cursor() as cur:
+        cur.execute("SELECT id, driver_id FROM rides WHERE id = ANY(%s)", (ride_ids,))
+        stored = dict(cur.fetchall())
+        cur.execute("SELECT id FROM drivers WHERE id = ANY(%s) AND NOT available", (driver_ids,))
+        busy = {row[0] for row in cur.fetchall()}
+    conn.close()
+    return {"claimed": len(winners),
+            "told_more_than_one": sum(len(w) > 1 for w in winners.values()),
+            "wrong_driver_stored": sum(len(w) == 1 and stored[ride] != w[0] for ride, w in winners.items()),
+            "busy_without_ride": len(busy - set(stored.values()))}
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * q) - 1)] if values else 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--contenders", type=int, default=10, help="concurrent accepts per ride")
+    parser.add_argument("--rides", type=int, default=200)
+    parser.add_argument("--parallel", type=int, default=20, help="rides contested at the same time")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--port", type=int, default=8103)
+    parser.add_argument("--lock-sample-ms", type=float, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, scratch_database("taxi_contention") as database:
+        ride_ids, driver_ids = seed(database, args.rides, args.rides * args.contenders)
+        server = stack.start("driver-service", args.port, database, args.workers, tmp)
+        stack.wait_ready({"driver-service": (server, args.port)})
+        try:
+            async def run():
+                limits = httpx.Limits(max_connections=args.contenders * args.parallel)
+                async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=60) as client:
+                    return await contest(client, ride_ids, driver_ids, args.contenders, args.parallel)
+
+            sampler = LockWaitSampler(database, args.lock_sample_ms / 1000)
+            sampler.start()
+            start = time.perf_counter()
+            results = asyncio.run(run())
+            elapsed = time.perf_counter() - start
+            sampler.stop()
+            means = statement_means(httpx.get(f"http://127.0.0.1:{args.port}/metrics").text)
+        finally:
+            stack.stop([server])
+        outcome = verify(database, ride_ids, driver_ids, results)
+
+    statuses = collections.Counter(status for _, _, status, _ in results)
+    latencies = [latency * 1000 for *_, latency in results]
+    double = outcome["told_more_than_one"] + outcome["wrong_driver_stored"]
+    print(f"{args.rides} rides x {args.contenders} contenders, {args.parallel} rides at a time, {args.workers} workers")
+    print(f"accepts {len(results)} in {elapsed:.2f} s: {len(results) / elapsed:.0f} accepts/s, "
+          f"{outcome['claimed'] / elapsed:.0f} claims/s, p50 {percentile(latencies, 0.5):.1f} ms, p99 {percentile(latencies, 0.99):.1f} ms")
+    print("statuses " + ", ".join(f"{status}: {count}" for status, count in sorted(statuses.items())))
+    print(f"claimed {outcome['claimed']} of {args.rides} rides, conflicts {statuses[400]}")
+    print(f"double assignments: {outcome['told_more_than_one']} rides told more than one driver they won, "
+          f"{outcome['wrong_driver_stored']} stored a driver other than the single winner, "
+          f"{outcome['busy_without_ride']} drivers left busy without a ride")
+    print(f"lock wait: {sampler.waiter_seconds:.2f} backend-seconds, peak {sampler.peak} waiters; "
+          + ", ".join(f"{statement} mean {ms:.2f} ms" for statement, ms in sorted(means.items())
+                      if statement in ("select_ride_status", "accept_ride", "mark_driver_busy")))
+    failed = double or set(statuses) - {200, 400}
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+# bench/generate_data.py
+"""Bulk-loads synthetic passengers, drivers and ride history for benchmarking at scale.
+
+Rows are generated on the fly and streamed into Postgres with COPY, so
+millions of rides load without building them in memory:
+
+    DB_HOST=localhost python bench/generate_data.py --passengers 1000000 --drivers 50000 --rides 20000000
+
+The same --seed, counts and --end give identical data when loaded into empty
+tables (--truncate). Rides are spread over
+the --days before --end, with more on weekdays and at rush hours, and ids
+follow requested_at the way they do in production. Each ride gets a
+lognormal wait for a driver and trip length. Its status follows from how
+long before --end it was requested:
+- recent rides are still pending or accepted
+- older ones are completed
+- CANCEL_RATE of them were cancelled before a driver took them
+
+A few passengers and drivers take most of the rides. Drivers with a ride in
+progress are marked unavailable. New ids continue after the existing rows.
+Monthly rides partitions are created for the whole span first. The tables
+are ANALYZEd at the end so query plans reflect the new size.
+"""
+import argparse
+import datetime
+import functools
+import math
+import os
+import random
+import time
+
+import psycopg2
+
+DSN = dict(host=os.getenv("DB_HOST", "localhost"), dbname=os.getenv("DB_NAME", "taxi_db"),
+           user=os.getenv("DB_USER", "postgres"), password=os.getenv("DB_PASS", "postgres"))
+
+# relative ride volume per hour of day and per weekday, Monday first
+HOURLY = (2, 1, 1, 1, 1, 2, 4, 8, 10, 7, 5, 5, 6, 5, 5, 6, 8, 10, 9, 7, 6, 5, 4, 3)
+WEEKDAY = (1.0, 1.0, 1.0, 1.05, 1.2, 1.1, 0.8)
+# medians and spread of the lognormal wait for a driver and trip length, in seconds
+WAIT_MEDIAN, WAIT_SIGMA = 180, 0.6
+TRIP_MEDIAN, TRIP_SIGMA = 900, 0.5
+CANCEL_RATE = 0.07
+# rides per passenger/driver follow id ** SKEW, so low ids are the regulars
+SKEW = 2.5
+NULL = "\\N"
+
+
+class RowStream:
+    """File-like view of an iterator of COPY text lines, for copy_expert."""
+
+    def __init__(self, lines):
+        self.lines = lines
+        self.buffer = ""
+        self.rows = 0
+
+    def read(self, size=-1):
+        chunks, length = [self.buffer], len(self.buffer)
+        for line in self.lines:
+            chunks.append(line)
+            length += len(line)
+            self.rows += 1
+            if length >= size > 0:
+                break
+        data = "".join(chunks)
+        if size > 0:
+            data, self.buffer = data[:size], data[size:]
+        else:
+            self.buffer = ""
+        return data
+
+
+@functools.lru_cache(maxsize=None)
+def day_prefix(day):
+    return datetime.datetime.fromtimestamp(day * 86400, datetime.timezone.utc).strftime("%Y-%m-%d ")
+
+
+def ts(epoch):
+    # strftime per timestamp was half the generation time; the date part only changes once a day
+    day, second = divmod(int(epoch), 86400)
+    hour, second = divmod(second, 3600)
+    minute, second = divmod(second, 60)
+    return f"{day_prefix(day)}{hour:02d}:{minute:02d}:{second:02d}"
+
+
+def people(prefix, first_id, count, created_before, rng, available=None):
+    for i in range(first_id, first_id + count):
+        created = ts(created_before - rng.random() * 365 * 86400)
+        if available is None:
+            yield f"{i}\t{prefix}-{i}\t{created}\n"
+        else:
+            yield f"{i}\t{prefix}-{i}\t{available}\t{created}\n"
+
+
+def request_times(count, start, days, rng):
+    """Yields `count` request times between start and start + days, in order."""
+    day_weights = [WEEKDAY[datetime.datetime.fromtimestamp(start + d * 86400, datetime.timezone.utc).weekday()]
+                   for d in range(days)]
+    total = sum(day_weights)
+    emitted = 0
+    for day, weight in enumerate(day_weights):
+        n = count - emitted if day == days - 1 else round(count * weight / total)
+        n = min(n, count - emitted)
+        emitted += n
+        hours = rng.choices(range(24), weights=HOURLY, k=n)
+        for offset in sorted(hour * 3600 + rng.random() * 3600 for hour in hours):
+            yield start + day * 86400 + offset
+
+
+def rides(first_id, count, passengers, drivers, end, days, rng, busy):
+    start = end - days * 86400
+    for ride_id, requested in enumerate(request_times(count, start, days, rng), first_id):
+        passenger_id = passengers[0] + int(passengers[1] * rng.random() ** SKEW)
+        wait = rng.lognormvariate(math.log(WAIT_MEDIAN), WAIT_SIGMA)
+        trip = rng.lognormvariate(math.log(TRIP_MEDIAN), TRIP_SIGMA)
+        age = end - requested
+        driver_id = accepted = completed = None
+        if age >= wait and rng.random() < CANCEL_RATE:
+            status, updated = "cancelled", requested + wait
+        elif age >= wait + trip:
+            driver_id = drivers[0] + int(drivers[1] * rng.random() ** SKEW)
+            accepted, completed = requested + wait, requested + wait + trip
+            status, updated = "completed", completed
+        elif age >= wait and len(busy) < drivers[1]:
+            # one ride in progress per driver
+            driver_id = drivers[0] + int(drivers[1] * rng.random() ** SKEW)
+            while driver_id in busy:
+                driver_id = drivers[0] + int(drivers[1] * rng.random())
+            busy.add(driver_id)
+            accepted = requested + wait
+            status, updated = "accepted", accepted
+        else:
+            status, updated = "pending", requested
+        yield (f"{ride_id}\t{passenger_id}\t{driver_id or NULL}\t{status}\t{ts(requested)}\t"
+               f"{ts(accepted) if accepted else NULL}\t{ts(completed) if completed else NULL}\t{ts(updated)}\n")
+
+
+def copy(cur, table, columns, lines, freeze=False):
+    stream = RowStream(lines)
+    start = time.perf_counter()
+    # FREEZE writes the rows already frozen, so the first reads and vacuum don't rewrite every page;
+    # only allowed when the table was truncated in the same transaction
+    options = " WITH (FREEZE)" if freeze else ""
+    cur.copy_expert(f"COPY {table} ({', '.join(columns)}) FROM STDIN{options}", stream, size=1 << 20)
+    elapsed = time.perf_counter() - start
+    print(f"{table:<12}{stream.rows:>12,} rows {elapsed:>8.1f} s {stream.rows / elapsed:>10,.0f} rows/s")
+
+
+def next_id(cur, table):
+    cur.execute(f"SELECT COALESCE(MAX(id), 0) + 1 FROM {table}")
+    return cur.fetchone()[0]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--passengers", type=int, default=100_000)
+    parser.add_argument("--drivers", type=int, default=10_000)
+    parser.add_argument("--rides", type=int, default=1_000_000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--end", default=datetime.date.today().isoformat(), help="UTC date the history runs up to")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--truncate", action="store_true", help="empty the tables first")
+    parser.add_argument("--skip-fk-checks", action="store_true",
+                        help="load with session_replication_role=replica; needs a superuser, ids are consistent by construction")
+    args = parser.parse_args()
+
+    end = datetime.datetime.fromisoformat(args.end).replace(tzinfo=datetime.timezone.utc).timestamp()
+    start = end - args.days * 86400
+    with psycopg2.connect(**DSN) as conn, conn.cursor() as cur:
+        if args.truncate:
+            cur.execute("TRUNCATE rides, ride_routes, drivers, passengers RESTART IDENTITY")
+        if args.skip_fk_checks:
+            cur.execute("SET session_replication_role = replica")
+        first = {table: next_id(cur, table) for table in ("passengers", "drivers", "rides")}
+        # one generator per table, so changing one count doesn't reshuffle the others
+        copy(cur, "passengers", ("id", "name", "created_at"),
+             people("passenger", first["passengers"], args.passengers, start, random.Random(f"{args.seed}-passengers")),
+             args.truncate)
+        copy(cur, "drivers", ("id", "name", "available", "created_at"),
+             people("driver", first["drivers"], args.drivers, start, random.Random(f"{args.seed}-drivers"), available="t"),
+             args.truncate)
+        busy = set()
+        # rides has no default partition, every month of the history needs its own first
+        cur.execute("SELECT create_ride_partitions(%s, %s)", (ts(start), ts(end)))
+        print(f"created {cur.fetchone()[0]} ride partitions")
+        # no FREEZE: Postgres refuses it on a partitioned table
+        copy(cur, "rides", ("id", "passenger_id", "driver_id", "status", "requested_at", "accepted_at", "completed_at", "updated_at"),
+             rides(first["rides"], args.rides, (first["passengers"], args.passengers), (first["drivers"], args.drivers),
+                   end, args.days, random.Random(f"{args.seed}-rides"), busy))
+        if args.skip_fk_checks:
+            # replica mode also skips the trigger that fills ride_routes
+            cur.execute("INSERT INTO ride_routes (id, requested_at) SELECT id, requested_at FROM rides WHERE id >= %s "
+                        "ON CONFLICT (id) DO UPDATE SET requested_at = EXCLUDED.requested_at", (first["rides"],))
+        if busy:
+            cur.execute("UPDATE drivers SET available = FALSE WHERE id = ANY(%s)", (sorted(busy),))
+        # COPY with explicit ids leaves the sequences behind
+        for table in ("passengers", "drivers", "rides"):
+            cur.execute(f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT MAX(id) FROM {table}))")
+        cur.execute("SELECT status, COUNT(*) FROM rides GROUP BY status ORDER BY 2 DESC")
+        print("rides by status: " + ", ".join(f"{status} {count:,}" for status, count in cur.fetchall()))
+        for table in ("passengers", "drivers", "rides"):
+            cur.execute(f"ANALYZE {table}")
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+# bench/handler_bench.py
+"""Per-endpoint cost of driver-service and passenger-service, in-process.
+
+Imports both service apps, runs their lifespans against a scratch database
+on a local Postgres and drives every endpoint sequentially through an ASGI
+client, so there is no network, container or load generator in the numbers:
+
+    DB_HOST=localhost python bench/handler_bench.py --iterations 2000
+
+Each endpoint is measured in three modes, each in a fresh interpreter:
+
+- bare: service loggers at WARNING, no tracing
+- logs: service logging as deployed
+- traced: logs plus the FastAPI instrumentation and SQL spans, every request
+  sampled, spans exported to a discarding exporter
+
+and each request's time is split into SQL statements (from
+db_query_duration_seconds), response serialization (FastAPI's encoding plus
+the JSON render) and the rest: routing, validation, middleware, the threadpool
+hop, pool checkout and commit, the handler's own Python, logging and tracing.
+Two framework rows give the floor: a plain FastAPI sync route and /healthz
+through the services' middleware stack. Allocation is the peak traced memory
+above the starting point during one request, from a separate tracemalloc
+pass.
+"""
+import argparse
+import asyncio
+import contextlib
+import importlib.util
+import json
+import logging
+import os
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from scratch_db import ROOT, SERVER, scratch_database  # noqa: E402
+
+MODES = ("bare", "logs", "traced")
+# ids of the passenger and driver the requests act as, created per run
+fixtures = {}
+
+
+def rides(cur, n, status="pending", driver_id=None):
+    cur.execute("INSERT INTO rides (passenger_id, status, driver_id, accepted_at) "
+                "SELECT %s, %s, %s, CASE WHEN %s = 'accepted' THEN NOW() END FROM generate_series(1, %s) RETURNING id",
+                (fixtures["passenger_id"], status, driver_id, status, n))
+    return [row[0] for row in cur.fetchall()]
+
+
+# each case: (name, service, setup) where setup(cur, n) returns n (method, url, kwargs) requests
+CASES = [
+    ("framework: plain FastAPI route", None, lambda cur, n: [("GET", "/ride_status/1", {})] * n),
+    ("framework: GET /healthz", "passenger-service", lambda cur, n: [("GET", "/healthz", {})] * n),
+    ("POST /passengers", "passenger-service",
+     lambda cur, n: [("POST", "/passengers", {"json": {"name": "bench"}})] * n),
+    ("POST /request_ride", "passenger-service",
+     lambda cur, n: [("POST", "/request_ride", {"json": {"passenger_id": fixtures["passenger_id"]}})] * n),
+    ("GET /ride_status/{id}", "passenger-service",
+     lambda cur, n: [("GET", f"/ride_status/{ride_id}", {}) for ride_id in rides(cur, n)]),
+    ("POST /drivers", "driver-service",
+     lambda cur, n: [("POST", "/drivers", {"json": {"name": "bench"}})] * n),
+    ("GET /available_rides", "driver-service",
+     lambda cur, n: [("GET", "/available_rides", {})] * n),
+    ("POST /accept_ride/{id}", "driver-service",
+     lambda cur, n: [("POST", f"/accept_ride/{ride_id}", {"params": {"driver_id": fixtures["driver_id"]}})
+                     for ride_id in rides(cur, n)]),
+    ("POST /complete_ride/{id}", "driver-service",
+     lambda cur, n: [("POST", f"/complete_ride/{ride_id}", {"params": {"driver_id": fixtures["driver_id"]}})
+                     for ride_id in rides(cur, n, "accepted", fixtures["driver_id"])]),
+]
+
+
+def load_app(service):
+    # both services' modules are called app, so each is loaded under its own name
+    spec = importlib.util.spec_from_file_location(service.replace("-", "_"), os.path.join(ROOT, service, "app.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def plain_app():
+    from fastapi import FastAPI
+    app = FastAPI()
+
+    @app.get("/ride_status/{ride_id}")
+    def ride_status(ride_id: int):
+        return {"id": ride_id, "status": "pending"}
+
+    return app
+
+
+def discarding_tracer_provider(service_name):
+    from opentelemetry import trace
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+
+    class DiscardExporter(SpanExporter):
+        def export(self, spans):
+            return SpanExportResult.SUCCESS
+
+    provider = TracerProvider()
+    provider.add_span_processor(BatchSpanProcessor(DiscardExporter()))
+    trace.set_tracer_provider(provider)
+    return provider
+
+
+class Timings:
+    """Accumulates time spent in FastAPI's response encoding and JSON render."""
+
+    def __init__(self):
+        import fastapi.routing
+        from fastapi.responses import JSONResponse
+        self.serialize = 0.0
+        serialize_response, render = fastapi.routing.serialize_response, JSONResponse.render
+
+        async def timed_serialize_response(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await serialize_response(*args, **kwargs)
+            finally:
+                self.serialize += time.perf_counter() - start
+
+        def timed_render(response, content):
+            start = time.perf_counter()
+            try:
+                return render(response, content)
+            finally:
+                self.serialize += time.perf_counter() - start
+
+        fastapi.routing.serialize_response = timed_serialize_response
+        JSONResponse.render = timed_render
+
+    @staticmethod
+    def db():
+        from taxi_common.db import DB_QUERY_LATENCY
+        return sum(sample.value for metric in DB_QUERY_LATENCY.collect() for sample in metric.samples
+                   if sample.name.endswith("_sum"))
+
+
+async def send(client, requests):
+    for method, url, kwargs in requests:
+        (await client.request(method, url, **kwargs)).raise_for_status()
+
+
+async def measure(client, requests, warmup, timings):
+    await send(client, requests[:warmup])
+    requests = requests[warmup:]
+    db, serialize = timings.db(), timings.serialize
+    start = time.perf_counter()
+    await send(client, requests)
+    elapsed = time.perf_counter() - start
+    per_op = lambda seconds: seconds / len(requests) * 1e6
+    result = {"ops": len(requests) / elapsed, "mean_us": per_op(elapsed), "db_us": per_op(timings.db() - db),
+              "serialize_us": per_op(timings.serialize - serialize)}
+    result["rest_us"] = result["mean_us"] - result["db_us"] - result["serialize_us"]
+    return result
+
+
+async def measure_allocations(client, requests):
+    peaks = []
+    tracemalloc.start()
+    try:
+        for method, url, kwargs in requests:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            (await client.request(method, url, **kwargs)).raise_for_status()
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+    return statistics.median(peaks) / 1024
+
+
+async def run_child(mode, iterations, warmup, alloc_iterations):
+    import httpx
+    import psycopg2
+    if mode == "traced":
+        import taxi_common.bootstrap
+        taxi_common.bootstrap.setup_tracing = discarding_tracer_provider
+    apps = {service: load_app(service).app for service in ("passenger-service", "driver-service")}
+    apps[None] = plain_app()
+    timings = Timings()
+
+    results = {}
+    async with contextlib.AsyncExitStack() as stack:
+        for service in ("passenger-service", "driver-service"):
+            await stack.enter_async_context(apps[service].router.lifespan_context(apps[service]))
+            if mode == "bare":
+                logging.getLogger(service).setLevel(logging.WARNING)
+        with psycopg2.connect(dbname=os.environ["DB_NAME"], **SERVER) as conn, conn.cursor() as cur:
+            cur.execute("INSERT INTO passengers (name) VALUES ('bench') RETURNING id")
+            fixtures["passenger_id"] = cur.fetchone()[0]
+            cur.execute("INSERT INTO drivers (name) VALUES ('bench') RETURNING id")
+            fixtures["driver_id"] = cur.fetchone()[0]
+        for name, service, setup in CASES:
+            with psycopg2.connect(dbname=os.environ["DB_NAME"], **SERVER) as conn, conn.cursor() as cur:
+                # a fixed ride list for every case, so /available_rides always returns the same rows
+                cur.execute("TRUNCATE rides, ride_routes")
+                rides(cur, 100)
+                requests = setup(cur, warmup + iterations + alloc_iterations)
+            transport = httpx.ASGITransport(app=apps[service])
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                results[name] = await measure(client, requests[:warmup + iterations], warmup, timings)
+                results[name]["alloc_kib"] = await measure_allocations(client, requests[warmup + iterations:])
+    return results
+
+
+def run_mode(mode, args, database):
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(ROOT), DB_NAME=database, DB_HOST=SERVER["host"],
+               TRACE_EXPORTER="jaeger" if mode == "traced" else "none")
+    cmd = [sys.executable, os.path.abspath(__file__), "--child", mode, "--iterations", str(args.iterations),
+           "--warmup", str(args.warmup), "--alloc-iterations", str(args.alloc_iterations)]
+    # the services also log to stderr
+    result = subprocess.run(cmd, env=env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=200)
+    parser.add_argument("--alloc-iterations", type=int, default=200)
+    parser.add_argument("--modes", default=",".join(MODES))
+    parser.add_argument("--json", help="also write the results here")
+    parser.add_argument("--child", choices=MODES, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(asyncio.run(run_child(args.child, args.iterations, args.warmup, args.alloc_iterations))))
+        return
+
+    with scratch_database() as database:
+        results = {mode: run_mode(mode, args, database) for mode in args.modes.split(",")}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+    print(f"{'endpoint':<34}{'mode':<8}{'ops/s':>8}{'mean us':>9}{'sql us':>8}{'json us':>9}{'rest us':>9}{'KiB':>7}")
+    for name, _, _ in CASES:
+        for mode, cases in results.items():
+            r = cases[name]
+            print(f"{name:<34}{mode:<8}{r['ops']:>8.0f}{r['mean_us']:>9.0f}{r['db_us']:>8.0f}"
+                  f"{r['serialize_us']:>9.0f}{r['rest_us']:>9.0f}{r['alloc_kib']:>7.1f}")
+
+
+if __name__ == "__main__":
+    main()
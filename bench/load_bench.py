@@ -0,0 +1,157 @@
+# bench/load_bench.py
+"""Headless load run of the ride lifecycle, gated against a stored baseline.
+
+Boots passenger-service and driver-service under gunicorn against a scratch
+database on a local Postgres, runs locust/locustfile.py with a fixed profile
+and writes a JSON report of throughput and p50/p95/p99 per endpoint, to
+/tmp/load-bench/load_report.json unless --report says otherwise:
+
+    DB_HOST=localhost python bench/load_bench.py --report load.json
+
+With a baseline (--baseline, default bench/load_baseline.json) every endpoint
+is compared against it and the run exits non-zero when a percentile is more
+than --threshold slower, or its error rate is more than --max-error-rate above
+the baseline's. The ride timings from the locustfile are reported, not gated.
+--save-baseline stores this run's report as the new baseline instead. The
+baseline is only meaningful on the machine it was recorded on.
+"""
+import argparse
+import csv
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stack  # noqa: E402
+from scratch_db import ROOT, scratch_database  # noqa: E402
+
+SERVICES = {"passenger-service": 8101, "driver-service": 8102}
+PERCENTILES = ("p50", "p95", "p99")
+# the fixed profile; changing it invalidates stored baselines
+PROFILE = {"users": 100, "spawn_rate": 20, "duration": "60s", "passenger_weight": 3, "driver_weight": 1,
+           "poll_interval": 0.5, "trip_min": 0.5, "trip_max": 2, "workers": 2}
+
+
+def start_services(database, profile, tmp):
+    servers = {service: (stack.start(service, port, database, profile["workers"], os.path.join(tmp, service)), port)
+               for service, port in SERVICES.items()}
+    stack.wait_ready(servers)
+    return [server for server, _ in servers.values()]
+
+
+def run_locust(profile, csv_prefix):
+    env = dict(os.environ, PASSENGER_API=f"http://127.0.0.1:{SERVICES['passenger-service']}",
+               DRIVER_API=f"http://127.0.0.1:{SERVICES['driver-service']}",
+               PASSENGER_WEIGHT=str(profile["passenger_weight"]), DRIVER_WEIGHT=str(profile["driver_weight"]),
+               POLL_INTERVAL=str(profile["poll_interval"]), TRIP_MIN=str(profile["trip_min"]), TRIP_MAX=str(profile["trip_max"]))
+    # locust exits 1 on any failure; failures are judged from the stats instead
+    subprocess.run(["locust", "-f", os.path.join(ROOT, "locust", "locustfile.py"), "--headless", "--only-summary",
+                    "-u", str(profile["users"]), "-r", str(profile["spawn_rate"]), "-t", profile["duration"],
+                    "--csv", csv_prefix], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def read_stats(csv_prefix):
+    endpoints, rides = {}, {}
+    with open(f"{csv_prefix}_stats.csv") as f:
+        for row in csv.DictReader(f):
+            # locust's aggregate row mixes in the ride timings, so throughput is summed below instead
+            if row["Name"] == "Aggregated" or not int(row["Request Count"]):
+                continue
+            stats = {"requests": int(row["Request Count"]), "failures": int(row["Failure Count"]),
+                     "rps": round(float(row["Requests/s"]), 2),
+                     "p50": float(row["50%"]), "p95": float(row["95%"]), "p99": float(row["99%"])}
+            if row["Type"] == "ride":
+                rides[row["Name"]] = stats
+            else:
+                endpoints[f"{row['Type']} {row['Name']}"] = stats
+    with open(f"{csv_prefix}_failures.csv") as f:
+        errors = [{"endpoint": f"{row['Method']} {row['Name']}", "error": row["Error"], "count": int(row["Occurrences"])}
+                  for row in csv.DictReader(f)]
+    throughput = round(sum(e["rps"] for e in endpoints.values()), 2)
+    return {"throughput": throughput, "endpoints": endpoints, "rides": rides, "errors": errors}
+
+
+def error_rate(stats):
+    return stats["failures"] / stats["requests"]
+
+
+def compare(report, baseline, threshold, min_delta_ms, min_requests, max_error_rate):
+    # ride timings are mostly driver supply and trip length, so only the endpoints are gated
+    problems = []
+    for name, current in report["endpoints"].items():
+        before = baseline["endpoints"].get(name)
+        if before is None:
+            continue
+        if error_rate(current) > error_rate(before) + max_error_rate:
+            problems.append(f"{name}: {current['failures']} of {current['requests']} failed, "
+                            f"baseline {before['failures']} of {before['requests']}")
+        # too few samples and the percentiles are noise
+        if min(before["requests"], current["requests"]) < min_requests:
+            continue
+        for p in PERCENTILES:
+            if current[p] > before[p] * (1 + threshold) and current[p] - before[p] > min_delta_ms:
+                problems.append(f"{name}: {p} {before[p]:.0f} -> {current[p]:.0f} ms")
+    return problems
+
+
+def git_commit():
+    result = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True)
+    return result.stdout.strip() or None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--report", default=os.path.join("/tmp", "load-bench", "load_report.json"))
+    parser.add_argument("--baseline", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "load_baseline.json"))
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--threshold", type=float, default=0.3, help="allowed relative slowdown per percentile")
+    # back-to-back runs of the same commit move p99 by up to ~15 ms
+    parser.add_argument("--min-delta-ms", type=float, default=20, help="ignore slowdowns smaller than this")
+    parser.add_argument("--min-requests", type=int, default=50)
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--duration", help="override the profile's run time, e.g. 20s; not for gated runs")
+    args = parser.parse_args()
+
+    profile = dict(PROFILE, duration=args.duration or PROFILE["duration"])
+    with tempfile.TemporaryDirectory() as tmp, scratch_database() as database:
+        servers = start_services(database, profile, tmp)
+        try:
+            run_locust(profile, os.path.join(tmp, "locust"))
+        finally:
+            stack.stop(servers)
+        report = {"commit": git_commit(), "profile": profile, **read_stats(os.path.join(tmp, "locust"))}
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+    with open(args.report, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {args.report}")
+    print(f"{'endpoint':<42}{'reqs':>8}{'fails':>7}{'req/s':>8}{'p50':>7}{'p95':>7}{'p99':>7}")
+    for name, e in {**report["endpoints"], **report["rides"]}.items():
+        print(f"{name:<42}{e['requests']:>8}{e['failures']:>7}{e['rps']:>8.1f}{e['p50']:>7.0f}{e['p95']:>7.0f}{e['p99']:>7.0f}")
+    print(f"{report['throughput']:.1f} req/s across endpoints")
+    for error in report["errors"]:
+        print(f"  {error['count']:>5} x {error['endpoint']}: {error['error']}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Saved baseline to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; run with --save-baseline to record one")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["profile"] != profile:
+        sys.exit(f"Baseline was recorded with a different profile: {baseline['profile']}")
+    problems = compare(report, baseline, args.threshold, args.min_delta_ms, args.min_requests, args.max_error_rate)
+    for problem in problems:
+        print(f"REGRESSION {problem}")
+    print(f"{len(problems)} regressions against baseline from {baseline.get('commit')}")
+    sys.exit(1 if problems else 0)
+
+
+if __name__ == "__main__":
+    main()
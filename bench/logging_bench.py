@@ -0,0 +1,117 @@
+# bench/logging_bench.py
+"""Request latency with service logging off, synchronous and queued.
+
+Drives a minimal FastAPI app in-process whose sync handler logs the way the
+service endpoints do (two INFO records per request) and reports client-side
+latency percentiles for each logging mode:
+
+    python bench/logging_bench.py --requests 5000 --write-delay-us 200
+
+--write-delay-us adds a fixed delay to every stream write, standing in for a
+slow disk or a stderr pipe the container runtime is not draining.
+"""
+import argparse
+import asyncio
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+import httpx
+from fastapi import FastAPI
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from taxi_common.logs import QueuedLogHandler, TraceContextFilter, formatter  # noqa: E402
+
+
+class SlowStream:
+    def __init__(self, stream, delay):
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, data):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.stream.write(data)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def build_logger(mode, log_dir, write_delay):
+    logger = logging.getLogger(f"bench-{mode}")
+    logger.propagate = False
+    logger.setLevel(logging.INFO)
+    if mode == "off":
+        logger.setLevel(logging.WARNING)
+        return logger
+    file_handler = logging.FileHandler(os.path.join(log_dir, f"{mode}.log"))
+    file_handler.setFormatter(formatter)
+    # stderr is a pipe in the containers; devnull keeps the benchmark output readable
+    stream_handler = logging.StreamHandler(SlowStream(open(os.devnull, "w"), write_delay))
+    if mode == "sync":
+        handlers = [file_handler, stream_handler]
+    else:
+        handlers = [QueuedLogHandler([file_handler, stream_handler])]
+    for handler in handlers:
+        handler.addFilter(TraceContextFilter())
+        logger.addHandler(handler)
+    return logger
+
+
+def build_app(logger):
+    app = FastAPI()
+
+    @app.get("/rides/{ride_id}")
+    def ride(ride_id: int):
+        logger.info("Ride status requested for id %s", ride_id)
+        logger.info("Fetched %s available rides", 3)
+        return {"id": ride_id, "status": "pending"}
+
+    return app
+
+
+async def run(app, requests, concurrency):
+    latencies = []
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def one(i):
+            async with semaphore:
+                start = time.perf_counter()
+                r = await client.get(f"/rides/{i}")
+                latencies.append(time.perf_counter() - start)
+                r.raise_for_status()
+
+        # warm up routing, pydantic and the threadpool before measuring
+        await asyncio.gather(*(one(i) for i in range(min(200, requests))))
+        latencies.clear()
+        start = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(requests)))
+        elapsed = time.perf_counter() - start
+    return latencies, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--write-delay-us", type=float, default=0)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as log_dir:
+        print(f"{'mode':<8}{'req/s':>10}{'p50 us':>10}{'p95 us':>10}{'p99 us':>10}{'dropped':>9}")
+        for mode in ("off", "sync", "queued"):
+            logger = build_logger(mode, log_dir, args.write_delay_us / 1e6)
+            latencies, elapsed = asyncio.run(run(build_app(logger), args.requests, args.concurrency))
+            q = statistics.quantiles(latencies, n=100)
+            dropped = sum(getattr(h, "dropped", 0) for h in logger.handlers)
+            print(f"{mode:<8}{len(latencies) / elapsed:>10.0f}{q[49] * 1e6:>10.0f}{q[94] * 1e6:>10.0f}{q[98] * 1e6:>10.0f}{dropped:>9}")
+            for handler in logger.handlers:
+                handler.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+# bench/replay.py
+"""Replays captured traffic against a stack, at the captured pace or faster.
+
+Reads the JSONL files written by the services with CAPTURE_PATH set (plain or
+rotated and gzipped) and re-issues the requests to the target of each
+entry's service:
+
+    python bench/replay.py capture/*.jsonl* --speed 10 \\
+        --target passenger-service=http://localhost:8001 --target driver-service=http://localhost:8002
+
+Sends are open-loop. Each request goes out at its captured offset divided by
+--speed, so the inter-arrival distribution is kept, and a slow target falls
+behind schedule instead of lowering the offered load. --speed max sends as
+fast as --concurrency in-flight requests allow.
+
+Ids created by captured requests (the *_id fields of their responses) are
+mapped to the ids the replayed requests create, and substituted into later
+paths, params and bodies. A request waits for the one creating an id it uses,
+so nothing refers to a ride that doesn't exist yet at any speed; other state
+changes, like an accept and its complete, can still swap places when time is
+compressed hard enough. Ids never seen being created pass through
+unchanged. That is right when replaying against a copy of the captured
+database, and the only option for requests whose creating request wasn't
+sampled.
+
+Reports, per route:
+- the request count and status mix
+- replayed latency next to the captured latency
+- how far sends fell behind schedule
+"""
+import argparse
+import asyncio
+import collections
+import gzip
+import json
+import math
+import time
+
+import httpx
+
+
+def load(paths):
+    entries = []
+    for path in paths:
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt") as f:
+            entries.extend(json.loads(line) for line in f if line.strip())
+    entries.sort(key=lambda entry: entry["ts"])
+    return entries
+
+
+def references(entry):
+    """(field, value) pairs of the ids an entry's path, params and body refer to."""
+    refs = list(route_params(entry["route"], entry["path"]).values()) + list(entry["params"].items())
+    if isinstance(entry.get("body"), dict):
+        refs += entry["body"].items()
+    return [(key, value) for key, value in refs if key.endswith("_id")]
+
+
+def route_params(route, path):
+    # ("/accept_ride/{ride_id}", "/accept_ride/12") -> {1: ("ride_id", "12")}, keyed by path segment
+    parts, values = (route or "").split("/"), path.split("/")
+    if len(parts) != len(values):
+        return {}
+    return {i: (part[1:-1], value) for i, (part, value) in enumerate(zip(parts, values))
+            if part.startswith("{") and part.endswith("}")}
+
+
+class IdMap:
+    """Captured id -> replayed id, per field name.
+
+    A request that refers to an id whose creating request is still in flight
+    waits for it, so compressing time doesn't send an accept before the ride
+    it accepts exists.
+    """
+
+    def __init__(self):
+        self.ids = {}
+        self.pending = {}
+        self.unmapped = 0
+        # creating responses the replayed ids couldn't be read from; their ids pass through unmapped
+        self.unlearned = 0
+
+    def expect(self, entry):
+        """Marks the ids `entry` will create as pending; called in capture order, as the entry is scheduled."""
+        # ids it refers to itself are not its to create, or an accept would wait on itself
+        refers = {(key, str(value)) for key, value in references(entry)}
+        for key, old in entry.get("ids", {}).items():
+            if (key, str(old)) not in refers and (key, old) not in self.ids and (key, old) not in self.pending:
+                self.pending[key, old] = asyncio.get_running_loop().create_future()
+
+    def learn(self, captured, replayed):
+        if not isinstance(replayed, dict):
+            self.unlearned += 1
+            return
+        for key, old in captured.items():
+            if isinstance(replayed.get(key), int):
+                self.ids[key, old] = replayed[key]
+
+    def settle(self, captured):
+        # after the response, mapped or not, so nothing waits forever on a failed request
+        for key, old in captured.items():
+            future = self.pending.pop((key, old), None)
+            if future is not None:
+                future.set_result(None)
+
+    async def get(self, key, value):
+        if not key.endswith("_id"):
+            return value
+        try:
+            old = int(value)
+        except (TypeError, ValueError):
+            return value
+        if (key, old) in self.pending:
+            await self.pending[key, old]
+        new = self.ids.get((key, old))
+        if new is None:
+            self.unmapped += 1
+            return value
+        return str(new) if isinstance(value, str) else new
+
+    async def rewrite(self, entry):
+        segments = entry["path"].split("/")
+        for i, (key, value) in route_params(entry["route"], entry["path"]).items():
+            segments[i] = await self.get(key, value)
+        params = {k: await self.get(k, v) for k, v in entry["params"].items()}
+        body = entry.get("body")
+        if isinstance(body, dict):
+            body = {k: await self.get(k, v) for k, v in body.items()}
+        return "/".join(segments), params, body
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[max(0, math.ceil(len(values) * q) - 1)] if values else 0
+
+
+async def replay(entries, targets, speed, concurrency, remap):
+    ids = IdMap()
+    results = []
+    in_flight = asyncio.Semaphore(concurrency)
+    loop = asyncio.get_running_loop()
+
+    async def issue(client, entry, lag):
+        captured = entry.get("ids", {}) if remap else {}
+        try:
+            path, params, body = await ids.rewrite(entry) if remap else (entry["path"], entry["params"], entry.get("body"))
+            kwargs = {"json": body} if "body" in entry else {}
+            start = time.perf_counter()
+            try:
+                response = await client.request(entry["method"], targets[entry["service"]] + path, params=params, **kwargs)
+                status = response.status_code
+                if captured and status < 300:
+                    try:
+                        ids.learn(captured, response.json())
+                    except ValueError:
+                        # not JSON; losing this one mapping beats losing the whole replay
+                        ids.unlearned += 1
+            except httpx.TransportError:
+                status = 0
+        finally:
+            ids.settle(captured)
+            in_flight.release()
+        route = f"{entry['service']} {entry['method']} {entry['route'] or entry['path']}"
+        results.append((route, status, (time.perf_counter() - start) * 1000, entry["duration_ms"], lag))
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=30) as client:
+        tasks = []
+        started, first = loop.time(), entries[0]["ts"]
+        for entry in entries:
+            due = started + (entry["ts"] - first) / speed if speed else loop.time()
+            if due > loop.time():
+                await asyncio.sleep(due - loop.time())
+            await in_flight.acquire()
+            if remap:
+                ids.expect(entry)
+            tasks.append(asyncio.create_task(issue(client, entry, max(0.0, loop.time() - due) * 1000)))
+        await asyncio.gather(*tasks)
+        elapsed = loop.time() - started
+    return results, elapsed, ids.unmapped, ids.unlearned
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+")
+    parser.add_argument("--target", action="append", default=[], metavar="SERVICE=URL", required=True)
+    parser.add_argument("--speed", default="1", help="time compression factor, or max")
+    parser.add_argument("--concurrency", type=int, default=256, help="cap on requests in flight")
+    parser.add_argument("--no-remap", action="store_true", help="send captured ids as they are")
+    parser.add_argument("--json", help="also write the per-route results here")
+    args = parser.parse_args()
+
+    targets = dict(target.split("=", 1) for target in args.target)
+    entries = load(args.paths)
+    skipped = sum(entry["service"] not in targets for entry in entries)
+    entries = [entry for entry in entries if entry["service"] in targets]
+    if not entries:
+        raise SystemExit("No captured requests for the given targets")
+    speed = None if args.speed == "max" else float(args.speed)
+    captured_span = entries[-1]["ts"] - entries[0]["ts"]
+    results, elapsed, unmapped, unlearned = asyncio.run(replay(entries, targets, speed, args.concurrency, not args.no_remap))
+
+    by_route = collections.defaultdict(list)
+    for route, *rest in results:
+        by_route[route].append(rest)
+    report = {}
+    print(f"{'route':<48}{'reqs':>7}  {'statuses':<22}{'p50':>7}{'p99':>7}{'was p50':>9}{'was p99':>9}{'lag p99':>9}")
+    for route, rows in sorted(by_route.items()):
+        statuses = collections.Counter(status for status, *_ in rows)
+        latency, captured, lag = ([row[i] for row in rows] for i in (1, 2, 3))
+        report[route] = {"requests": len(rows), "statuses": dict(statuses),
+                         "p50": percentile(latency, 0.5), "p99": percentile(latency, 0.99),
+                         "captured_p50": percentile(captured, 0.5), "captured_p99": percentile(captured, 0.99),
+                         "lag_p99": percentile(lag, 0.99)}
+        r = report[route]
+        mix = " ".join(f"{status}:{count}" for status, count in sorted(statuses.items()))
+        print(f"{route:<48}{len(rows):>7}  {mix:<22}{r['p50']:>7.1f}{r['p99']:>7.1f}{r['captured_p50']:>9.1f}"
+              f"{r['captured_p99']:>9.1f}{r['lag_p99']:>9.1f}")
+    print(f"{len(results)} requests in {elapsed:.1f} s ({len(results) / elapsed:.1f} req/s), captured over "
+          f"{captured_span:.1f} s; {unmapped} ids had no replayed counterpart, {unlearned} creating responses had no "
+          f"readable ids, {skipped} requests had no target")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
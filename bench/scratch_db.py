@@ -0,0 +1,44 @@
+# bench/scratch_db.py
+"""Throwaway Postgres databases for the benchmarks.
+
+Each run gets a fresh database built from db/init.sql on the server the
+services would use (DB_HOST etc.), and drops it afterwards, so results don't
+depend on whatever rows earlier runs left behind.
+"""
+import contextlib
+import os
+
+import psycopg2
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+SERVER = dict(host=os.getenv("DB_HOST", "localhost"), user=os.getenv("DB_USER", "postgres"),
+              password=os.getenv("DB_PASS", "postgres"))
+
+
+def admin_connection():
+    conn = psycopg2.connect(dbname="postgres", **SERVER)
+    # CREATE/DROP DATABASE can't run inside a transaction
+    conn.autocommit = True
+    return conn
+
+
+@contextlib.contextmanager
+def scratch_database(prefix="taxi_bench"):
+    """Yields the name of a new database with the service schema, dropped on exit."""
+    name = f"{prefix}_{os.getpid()}"
+    conn = admin_connection()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(f"DROP DATABASE IF EXISTS {name}")
+            cur.execute(f"CREATE DATABASE {name}")
+        with open(os.path.join(ROOT, "db", "init.sql")) as f:
+            schema = f.read()
+        with psycopg2.connect(dbname=name, **SERVER) as db, db.cursor() as cur:
+            cur.execute(schema)
+        db.close()
+        yield name
+    finally:
+        with conn.cursor() as cur:
+            # WITH (FORCE) also ends sessions a killed service left open
+            cur.execute(f"DROP DATABASE IF EXISTS {name} WITH (FORCE)")
+        conn.close()
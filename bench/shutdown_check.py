@@ -0,0 +1,134 @@
+# bench/shutdown_check.py
+"""Checks that SIGTERM under accept_ride load loses no accepted ride.
+
+Boots driver-service under gunicorn against a scratch database (see
+scratch_db.py), seeds pending rides, fires one accept per ride at the given
+concurrency and sends SIGTERM to the master partway through. Fails if:
+
+- a ride answered 200 is not accepted by that driver in the database,
+- a ride was accepted in the database but the client never got the answer,
+- an accepted ride's log line never reached the log files,
+- the server did not exit cleanly.
+
+    DB_HOST=localhost python bench/shutdown_check.py --rides 3000 --concurrency 64 --term-after 1.5
+"""
+import argparse
+import asyncio
+import glob
+import os
+import random
+import signal
+import sys
+import tempfile
+
+import httpx
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import stack  # noqa: E402
+from scratch_db import SERVER, scratch_database  # noqa: E402
+
+
+def seed(database, rides, drivers):
+    with psycopg2.connect(dbname=database, **SERVER) as conn, conn.cursor() as cur:
+        cur.execute("INSERT INTO passengers (name) VALUES ('shutdown-check') RETURNING id")
+        passenger_id = cur.fetchone()[0]
+        cur.execute("INSERT INTO drivers (name) SELECT 'shutdown-check' FROM generate_series(1, %s) RETURNING id", (drivers,))
+        driver_ids = [row[0] for row in cur.fetchall()]
+        cur.execute("INSERT INTO rides (passenger_id, status) SELECT %s, 'pending' FROM generate_series(1, %s) RETURNING id",
+                    (passenger_id, rides))
+        ride_ids = [row[0] for row in cur.fetchall()]
+    conn.close()
+    return ride_ids, driver_ids
+
+
+async def load(client, server, ride_ids, driver_ids, concurrency, term_after):
+    outcomes = {"accepted": {}, "rejected": 0, "refused": 0, "cut_off": []}
+    pending = iter(ride_ids)
+
+    async def worker():
+        for ride_id in pending:
+            driver_id = random.choice(driver_ids)
+            try:
+                r = await client.post(f"/accept_ride/{ride_id}", params={"driver_id": driver_id})
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                outcomes["refused"] += 1
+                continue
+            except httpx.TransportError as e:
+                # no complete answer; harmless if the server closed the keep-alive connection before
+                # reading the request (the ride stays pending), a failure if the accept went through
+                outcomes["cut_off"].append((ride_id, type(e).__name__))
+                continue
+            if r.status_code == 200:
+                outcomes["accepted"][ride_id] = driver_id
+            else:
+                outcomes["rejected"] += 1
+
+    async def terminate():
+        await asyncio.sleep(term_after)
+        server.send_signal(signal.SIGTERM)
+
+    await asyncio.gather(terminate(), *(worker() for _ in range(concurrency)))
+    return outcomes
+
+
+def verify(database, run_dir, outcomes, ride_ids):
+    with psycopg2.connect(dbname=database, **SERVER) as conn, conn.cursor() as cur:
+        cur.execute("SELECT id, status, driver_id FROM rides WHERE id = ANY(%s)", (ride_ids,))
+        rows = {ride_id: (status, driver_id) for ride_id, status, driver_id in cur.fetchall()}
+    conn.close()
+    lost = [ride_id for ride_id, driver_id in outcomes["accepted"].items() if rows.get(ride_id) != ("accepted", driver_id)]
+    # accepted in the database but the client never heard back, so it would retry into a 400
+    unconfirmed = [ride_id for ride_id, (status, _) in rows.items() if status == "accepted" and ride_id not in outcomes["accepted"]]
+    logged = set()
+    # only this run's server wrote here; the worker files are driver-service-<slot>.log
+    for path in glob.glob(os.path.join(stack.log_dir(run_dir), "driver-service*.log")):
+        if "-slow" in path:
+            continue
+        with open(path) as f:
+            for line in f:
+                if "accepted by driver" in line:
+                    logged.add(int(line.split('"Ride ')[1].split(" ")[0]))
+    unlogged = [ride_id for ride_id in outcomes["accepted"] if ride_id not in logged]
+    return lost, unconfirmed, unlogged
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rides", type=int, default=3000)
+    parser.add_argument("--drivers", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--term-after", type=float, default=1.5)
+    parser.add_argument("--port", type=int, default=8102)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, scratch_database("taxi_shutdown") as database:
+        ride_ids, driver_ids = seed(database, args.rides, args.drivers)
+        server = stack.start("driver-service", args.port, database, args.workers, tmp)
+        stack.wait_ready({"driver-service": (server, args.port)})
+        try:
+            async def run():
+                limits = httpx.Limits(max_connections=args.concurrency)
+                async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=30) as client:
+                    return await load(client, server, ride_ids, driver_ids, args.concurrency, args.term_after)
+            outcomes = asyncio.run(run())
+            exit_code = server.wait(timeout=60)
+        finally:
+            if server.poll() is None:
+                server.kill()
+                server.wait()
+        lost, unconfirmed, unlogged = verify(database, tmp, outcomes, ride_ids)
+
+    print(f"accepted {len(outcomes['accepted'])}, rejected {outcomes['rejected']}, refused after stop {outcomes['refused']}, "
+          f"connection closed without answer {len(outcomes['cut_off'])}")
+    print(f"lost {len(lost)}, accepted but unconfirmed {len(unconfirmed)}, accepted but not logged {len(unlogged)}, "
+          f"server exit {exit_code}")
+    failed = lost or unconfirmed or unlogged or exit_code != 0
+    if failed:
+        print(f"FAIL lost={lost[:10]} unconfirmed={unconfirmed[:10]} unlogged={unlogged[:10]}")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+# bench/stack.py
+"""Runs services under gunicorn for the benchmarks, the way their images do."""
+import os
+import subprocess
+import time
+
+import httpx
+
+from scratch_db import ROOT, SERVER
+
+
+def log_dir(run_dir):
+    return os.path.join(run_dir, "logs")
+
+
+def start(service, port, database, workers, run_dir, **env):
+    """Starts `service`; its metrics files and logs go under run_dir, away from any other run's."""
+    multiproc_dir = os.path.join(run_dir, "metrics")
+    os.makedirs(multiproc_dir, exist_ok=True)
+    env = dict(os.environ, PYTHONPATH=os.path.abspath(ROOT), PORT=str(port), DB_HOST=SERVER["host"], DB_NAME=database,
+               WEB_CONCURRENCY=str(workers), PROMETHEUS_MULTIPROC_DIR=multiproc_dir, LOG_DIR=log_dir(run_dir),
+               TRACE_EXPORTER=os.getenv("TRACE_EXPORTER", "none"), **env)
+    # the services also log to stderr; their log files are what callers read
+    return subprocess.Popen(["gunicorn", "-c", "python:taxi_common.gunicorn_conf", "app:app"],
+                            cwd=os.path.join(ROOT, service), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+
+def wait_ready(servers, timeout=30):
+    """Waits for /readyz on every {name: (process, port)}; stops them all if one never gets there."""
+    deadline = time.monotonic() + timeout
+    for name, (server, port) in servers.items():
+        while True:
+            try:
+                if httpx.get(f"http://127.0.0.1:{port}/readyz").status_code == 200:
+                    break
+            except httpx.TransportError:
+                pass
+            if time.monotonic() > deadline or server.poll() is not None:
+                stop(server for server, _ in servers.values())
+                raise SystemExit(f"{name} never became ready")
+            time.sleep(0.2)
+
+
+def stop(servers):
+    servers = list(servers)
+    for server in servers:
+        server.terminate()
+    for server in servers:
+        try:
+            server.wait(timeout=60)
+        except subprocess.TimeoutExpired:
+            server.kill()
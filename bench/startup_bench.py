@@ -0,0 +1,89 @@
+# bench/startup_bench.py
+"""Cold-start time of each service: import, lifespan startup and first request.
+
+Every run is a fresh interpreter, so the numbers include module imports the
+way a container start does. Startup doesn't wait for warm-up (the pool and
+the services' warm-up queries), so no database is needed:
+
+    python bench/startup_bench.py --runs 10 --exporter otlp
+
+--root points at another checkout (e.g. a `git worktree` of an older commit)
+to compare against it. --top prints the slowest imports of one run, from
+`python -X importtime`.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SERVICES = ("driver-service", "passenger-service", "web-ui")
+
+# runs inside the service directory; httpx is the harness's own import so it is loaded before timing,
+# and lifespan is driven by hand since ASGITransport skips it
+PROBE = """
+import asyncio, json, time
+import httpx
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+
+async def main():
+    async with app.app.router.lifespan_context(app.app):
+        started = time.perf_counter()
+        transport = httpx.ASGITransport(app=app.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            (await client.get("/metrics")).raise_for_status()
+        return started, time.perf_counter()
+
+started, served = asyncio.run(main())
+print(json.dumps({"import": imported - start, "startup": started - imported, "first_request": served - started}))
+"""
+
+
+def probe(root, service, env, importtime=False):
+    cmd = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", PROBE]
+    result = subprocess.run(cmd, cwd=os.path.join(root, service), env=env, capture_output=True, text=True, check=True)
+    return json.loads(result.stdout.strip().splitlines()[-1]), result.stderr
+
+
+def slowest_imports(stderr, top):
+    rows = []
+    for line in stderr.splitlines():
+        if line.startswith("import time:") and "|" in line and "cumulative" not in line:
+            _, cumulative, name = line[len("import time:"):].split("|")
+            # the service's own imports and the heavy ones they pull in, nested two levels under app
+            depth = (len(name) - len(name.lstrip())) // 2
+            if 1 <= depth <= 2:
+                rows.append((int(cumulative), name.strip()))
+    return sorted(rows, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--exporter", default="jaeger", choices=["jaeger", "otlp", "none"])
+    parser.add_argument("--root", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    parser.add_argument("--top", type=int, default=0)
+    args = parser.parse_args()
+
+    root = os.path.abspath(args.root)
+    # startup leaves warm-up running in the background; waiting for it would time the pool connecting,
+    # or all of WARMUP_TIMEOUT when there is no database
+    env = dict(os.environ, TRACE_EXPORTER=args.exporter, PYTHONPATH=root, LOG_DIR=os.path.join("/tmp", "startup-bench"),
+               WARMUP_TIMEOUT="0", WARMUP_GIVE_UP="0",
+               JAEGER_COLLECTOR="http://127.0.0.1:9/api/traces", OTEL_EXPORTER_OTLP_TRACES_ENDPOINT="http://127.0.0.1:9/v1/traces")
+    print(f"{'service':<20}{'import ms':>11}{'startup ms':>12}{'first req ms':>14}{'total ms':>10}")
+    for service in SERVICES:
+        runs = [probe(root, service, env)[0] for _ in range(args.runs)]
+        phases = {phase: statistics.median(run[phase] for run in runs) * 1000 for phase in runs[0]}
+        print(f"{service:<20}{phases['import']:>11.0f}{phases['startup']:>12.1f}{phases['first_request']:>14.1f}"
+              f"{statistics.median(sum(run.values()) for run in runs) * 1000:>10.0f}")
+        if args.top:
+            for cumulative, name in slowest_imports(probe(root, service, env, importtime=True)[1], args.top):
+                print(f"    {cumulative / 1000:>8.1f} ms  {name}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# bench/status_encoding.py
+"""Compares rides with status stored as the ride_status enum and as TEXT.
+
+Loads the synthetic dataset from generate_data.py into a scratch database,
+measures the rides table with the enum the schema uses, converts the column
+back to TEXT the way it was stored before and measures again:
+
+    DB_HOST=localhost python bench/status_encoding.py --rides 2000000
+
+Both layouts are measured right after a full rewrite (COPY, then ALTER
+TABLE), so neither carries dead rows. Reports:
+- heap size, average row size and the status column's size
+- the size of an index on status, built for the measurement and dropped
+- server-side execution time of the driver's pending-rides query and of a
+  count by status over every row, median of --repeat runs on a warm cache
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+import psycopg2
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from scratch_db import ROOT, SERVER, scratch_database  # noqa: E402
+
+QUERIES = {
+    "pending rides": "SELECT id, passenger_id, status FROM rides WHERE status='pending'",
+    "count by status": "SELECT status, COUNT(*) FROM rides GROUP BY status",
+}
+
+
+def execution_ms(cur, query, repeat):
+    timings = []
+    # the first run warms the cache and isn't counted
+    for _ in range(repeat + 1):
+        cur.execute("EXPLAIN (ANALYZE, FORMAT JSON) " + query)
+        timings.append(cur.fetchone()[0][0]["Execution Time"])
+    return statistics.median(timings[1:])
+
+
+def measure(cur, repeat):
+    cur.execute("VACUUM ANALYZE rides")
+    # rides and its indexes are partitioned, their own relations are empty; the partitions hold the data
+    cur.execute("SELECT SUM(pg_relation_size(relid)) FROM pg_partition_tree('rides')")
+    heap = int(cur.fetchone()[0])
+    cur.execute("SELECT AVG(pg_column_size(rides.*)), AVG(pg_column_size(status)) FROM rides")
+    row, status = cur.fetchone()
+    cur.execute("CREATE INDEX rides_status_measure ON rides (status)")
+    cur.execute("SELECT SUM(pg_relation_size(relid)) FROM pg_partition_tree('rides_status_measure')")
+    index = int(cur.fetchone()[0])
+    cur.execute("DROP INDEX rides_status_measure")
+    result = {"heap_bytes": heap, "row_bytes": float(row), "status_bytes": float(status), "status_index_bytes": index}
+    for name, query in QUERIES.items():
+        result[f"{name} ms"] = execution_ms(cur, query, repeat)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--passengers", type=int, default=100_000)
+    parser.add_argument("--drivers", type=int, default=10_000)
+    parser.add_argument("--rides", type=int, default=1_000_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--json", help="also write the results here")
+    args = parser.parse_args()
+
+    with scratch_database("taxi_status") as database:
+        subprocess.run([sys.executable, os.path.join(ROOT, "bench", "generate_data.py"), "--truncate",
+                        "--passengers", str(args.passengers), "--drivers", str(args.drivers), "--rides", str(args.rides)],
+                       env=dict(os.environ, DB_HOST=SERVER["host"], DB_NAME=database), check=True)
+        conn = psycopg2.connect(dbname=database, **SERVER)
+        # VACUUM can't run inside a transaction
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            after = measure(cur, args.repeat)
+            # the pending index's predicate compares with the enum; rebuilt as it would be for TEXT
+            cur.execute("DROP INDEX rides_pending_idx")
+            cur.execute("ALTER TABLE rides ALTER COLUMN status TYPE TEXT USING status::text")
+            cur.execute("CREATE INDEX rides_pending_idx ON rides (id) WHERE status = 'pending'")
+            before = measure(cur, args.repeat)
+        conn.close()
+
+    print(f"\n{'':<24}{'text':>14}{'enum':>14}{'change':>9}")
+    for key in after:
+        change = (after[key] - before[key]) / before[key] * 100 if before[key] else 0
+        print(f"{key:<24}{before[key]:>14,.1f}{after[key]:>14,.1f}{change:>8.1f}%")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"text": before, "enum": after}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# bench/tracing_bench.py
+"""Per-request tracing overhead for each sampling and export setting.
+
+Drives a minimal FastAPI app in-process, once uninstrumented and once per
+tracing setting, and reports the added latency over the uninstrumented run.
+Spans go through the real BatchSpanProcessor into an exporter that discards
+them, so the numbers cover span creation, recording and queueing but not the
+network:
+
+    python bench/tracing_bench.py --requests 5000
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+import httpx
+from fastapi import FastAPI
+from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, SpanExporter, SpanExportResult
+from opentelemetry.sdk.trace.sampling import ALWAYS_OFF, ALWAYS_ON, ParentBasedTraceIdRatio
+from opentelemetry.trace import NoOpTracerProvider
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from taxi_common.tracing import ErrorSpanProcessor, RecordUnsampledSampler  # noqa: E402
+
+
+class DiscardExporter(SpanExporter):
+    def __init__(self):
+        self.exported = 0
+
+    def export(self, spans):
+        self.exported += len(spans)
+        return SpanExportResult.SUCCESS
+
+
+def settings(ratio):
+    yield "uninstrumented", None, None
+    yield "noop", NoOpTracerProvider(), None
+    yield "always_off", ALWAYS_OFF, False
+    yield f"ratio {ratio}", ParentBasedTraceIdRatio(ratio), False
+    yield f"ratio {ratio} + errors", ParentBasedTraceIdRatio(ratio), True
+    yield "always_on", ALWAYS_ON, False
+
+
+def build_app(sampler, keep_errors):
+    app = FastAPI()
+
+    @app.get("/ride_status/{ride_id}")
+    def ride_status(ride_id: int):
+        return {"id": ride_id, "status": "pending"}
+
+    exporter = provider = None
+    if isinstance(sampler, NoOpTracerProvider):
+        FastAPIInstrumentor.instrument_app(app, tracer_provider=sampler)
+    elif sampler is not None:
+        exporter = DiscardExporter()
+        provider = TracerProvider(sampler=RecordUnsampledSampler(sampler) if keep_errors else sampler)
+        processor = BatchSpanProcessor(exporter)
+        provider.add_span_processor(ErrorSpanProcessor(processor) if keep_errors else processor)
+        FastAPIInstrumentor.instrument_app(app, tracer_provider=provider)
+    return app, exporter, provider
+
+
+async def run(app, requests):
+    latencies = []
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for i in range(min(500, requests)):
+            await client.get(f"/ride_status/{i}")
+        for i in range(requests):
+            start = time.perf_counter()
+            r = await client.get(f"/ride_status/{i}")
+            latencies.append(time.perf_counter() - start)
+            r.raise_for_status()
+    return latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=5000)
+    parser.add_argument("--ratio", type=float, default=0.1)
+    args = parser.parse_args()
+
+    print(f"{'setting':<22}{'p50 us':>10}{'mean us':>10}{'overhead us':>13}{'spans':>10}")
+    baseline = None
+    for name, sampler, keep_errors in settings(args.ratio):
+        app, exporter, provider = build_app(sampler, keep_errors)
+        latencies = asyncio.run(run(app, args.requests))
+        if provider is not None:
+            provider.force_flush()
+        mean = statistics.fmean(latencies)
+        baseline = mean if baseline is None else baseline
+        exported = "-" if exporter is None else exporter.exported
+        print(f"{name:<22}{statistics.median(latencies) * 1e6:>10.0f}{mean * 1e6:>10.0f}"
+              f"{(mean - baseline) * 1e6:>13.0f}{exported:>10}")
+
+
+if __name__ == "__main__":
+    main()
@@ -12,17 +12,123 @@ CREATE TABLE IF NOT EXISTS drivers (
     created_at TIMESTAMP DEFAULT NOW()
 );
 
+-- 4 bytes per row instead of the word; rejects anything else, like a check constraint would
+DO $$
+BEGIN
+    CREATE TYPE ride_status AS ENUM ('pending', 'accepted', 'completed', 'cancelled');
+EXCEPTION WHEN duplicate_object THEN NULL;
+END
+$$;
+
+-- Databases created before partitioning have rides as a plain table; it is set aside here and copied
+-- into the partitioned one below
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = to_regclass('rides')) = 'r' THEN
+        ALTER TABLE rides RENAME TO rides_unpartitioned;
+        ALTER INDEX rides_pkey RENAME TO rides_unpartitioned_pkey;
+        ALTER SEQUENCE rides_id_seq OWNED BY NONE;
+    END IF;
+END
+$$;
+
+CREATE SEQUENCE IF NOT EXISTS rides_id_seq AS INT;
+
+-- One partition per month of requested_at, so vacuum and the pending-rides index only deal with recent
+-- months and old ones are dropped whole. The key has to include requested_at; ids are still unique,
+-- they all come from the one sequence. No default partition: DETACH CONCURRENTLY refuses to run with one,
+-- and taxi_common/partitions.py keeps months ahead created instead, reporting ride_partitions_ahead so
+-- running out alerts (prometheus/alerts.yml) before inserts start failing.
 CREATE TABLE IF NOT EXISTS rides (
-    id SERIAL PRIMARY KEY,
+    id INT NOT NULL DEFAULT nextval('rides_id_seq'),
     passenger_id INT NOT NULL REFERENCES passengers(id) ON DELETE CASCADE,
     driver_id INT REFERENCES drivers(id) ON DELETE SET NULL,
-    status TEXT NOT NULL, -- pending, accepted, completed, cancelled
-    requested_at TIMESTAMP DEFAULT NOW(),
+    status ride_status NOT NULL,
+    requested_at TIMESTAMP NOT NULL DEFAULT NOW(),
     accepted_at TIMESTAMP,
     completed_at TIMESTAMP,
-    updated_at TIMESTAMP DEFAULT NOW()
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (id, requested_at)
+) PARTITION BY RANGE (requested_at);
+
+ALTER SEQUENCE rides_id_seq OWNED BY rides.id;
+
+-- Only the few pending rows are in it, so a month with none costs one empty index probe
+CREATE INDEX IF NOT EXISTS rides_pending_idx ON rides (id) WHERE status = 'pending';
+
+-- Which partition a ride id lives in. Services look rides up by id alone, which rides' key can't prune
+-- on; `id = %s AND requested_at = (SELECT requested_at FROM ride_routes WHERE id = %s)` lets the
+-- executor skip every partition but one.
+CREATE TABLE IF NOT EXISTS ride_routes (
+    id INT PRIMARY KEY,
+    requested_at TIMESTAMP NOT NULL
 );
 
+-- rides that existed before the table, in a database partitioned without it
+INSERT INTO ride_routes (id, requested_at)
+SELECT id, requested_at FROM rides WHERE NOT EXISTS (SELECT 1 FROM ride_routes)
+ON CONFLICT (id) DO NOTHING;
+
+-- Once per statement, so COPY and bulk inserts add their routes in one go; ids are reused after
+-- TRUNCATE ... RESTART IDENTITY, hence the upsert
+CREATE OR REPLACE FUNCTION add_ride_routes()
+RETURNS TRIGGER AS $$
+BEGIN
+    INSERT INTO ride_routes (id, requested_at)
+    SELECT id, requested_at FROM new_rides
+    ON CONFLICT (id) DO UPDATE SET requested_at = EXCLUDED.requested_at;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS rides_routes ON rides;
+CREATE TRIGGER rides_routes
+AFTER INSERT ON rides
+REFERENCING NEW TABLE AS new_rides
+FOR EACH STATEMENT
+EXECUTE PROCEDURE add_ride_routes();
+
+-- Creates the missing monthly partitions from from_ts's month through to_ts's; returns how many
+CREATE OR REPLACE FUNCTION create_ride_partitions(from_ts TIMESTAMP, to_ts TIMESTAMP)
+RETURNS INT AS $$
+DECLARE
+    month TIMESTAMP := date_trunc('month', from_ts);
+    partition TEXT;
+    created INT := 0;
+BEGIN
+    WHILE month <= to_ts LOOP
+        partition := 'rides_' || to_char(month, 'YYYY_MM');
+        IF to_regclass(partition) IS NULL THEN
+            -- created on its own and then attached, which only takes a lock on rides that reads and writes pass
+            EXECUTE format('CREATE TABLE %I (LIKE rides INCLUDING DEFAULTS)', partition);
+            EXECUTE format('ALTER TABLE rides ATTACH PARTITION %I FOR VALUES FROM (%L) TO (%L)',
+                           partition, month, month + INTERVAL '1 month');
+            created := created + 1;
+        END IF;
+        month := month + INTERVAL '1 month';
+    END LOOP;
+    RETURN created;
+END;
+$$ LANGUAGE plpgsql;
+
+SELECT create_ride_partitions(LOCALTIMESTAMP, LOCALTIMESTAMP + INTERVAL '3 months');
+
+DO $$
+BEGIN
+    IF to_regclass('rides_unpartitioned') IS NOT NULL THEN
+        -- requested_at used to be nullable
+        PERFORM create_ride_partitions(MIN(COALESCE(requested_at, updated_at, LOCALTIMESTAMP)), MAX(COALESCE(requested_at, updated_at, LOCALTIMESTAMP)))
+        FROM rides_unpartitioned;
+        -- status may still be TEXT in databases from before ride_status
+        INSERT INTO rides (id, passenger_id, driver_id, status, requested_at, accepted_at, completed_at, updated_at)
+        SELECT id, passenger_id, driver_id, status::TEXT::ride_status, COALESCE(requested_at, updated_at, LOCALTIMESTAMP),
+               accepted_at, completed_at, updated_at
+        FROM rides_unpartitioned;
+        DROP TABLE rides_unpartitioned;
+    END IF;
+END
+$$;
+
 -- Trigger to update updated_at
 CREATE OR REPLACE FUNCTION update_updated_at_column()
 RETURNS TRIGGER AS $$
@@ -1,38 +1,199 @@
-from locust import HttpUser, task, between
+# locust/locustfile.py
+"""Ride lifecycle load test.
+
+Every passenger user registers itself, then loops: request a ride, poll its
+status until a driver completes it. Every driver user registers itself, then
+loops: list pending rides, claim one this run's passengers requested, drive,
+complete it. Users only touch ids they created or were handed by the API, so
+the request stats measure real work rather than 404s and 400s.
+
+Besides the per-endpoint stats, each finished ride reports two custom entries
+under the "ride" type, taken from the ride's own timestamps:
+
+- time_to_accept: requested_at -> accepted_at
+- time_to_complete: requested_at -> completed_at
+
+Rides a passenger gives up on after RIDE_TIMEOUT show up as failures of
+those entries. Scale by user count; the passenger:driver mix is set with
+PASSENGER_WEIGHT and DRIVER_WEIGHT. LOAD_SHAPE=step|spike|soak drives the
+user count over time instead, see shapes.py.
+
+One process tops out at a core's worth of requests; past that, run a master
+and LOCUST_WORKERS worker processes, as docker-compose does. Workers pass
+the rides their passengers open and finish to each other through the master
+every RIDE_SYNC_INTERVAL seconds, so a driver on one worker claims rides
+requested on any of them.
+"""
+import os
 import random
+import time
+import uuid
+from datetime import datetime
+import gevent
+from locust import HttpUser, between, events, task
+from locust.runners import MasterRunner, WorkerRunner
+import shapes
+
+PASSENGER_API = os.getenv("PASSENGER_API", "http://passenger-service:8001")
+DRIVER_API = os.getenv("DRIVER_API", "http://driver-service:8002")
+# seconds between ride status polls, and before a waiting passenger gives up
+POLL_INTERVAL = float(os.getenv("POLL_INTERVAL", "1"))
+RIDE_TIMEOUT = float(os.getenv("RIDE_TIMEOUT", "120"))
+# how long a driver spends on a trip before completing it
+TRIP_MIN = float(os.getenv("TRIP_MIN", "2"))
+TRIP_MAX = float(os.getenv("TRIP_MAX", "10"))
+LOAD_SHAPE = os.getenv("LOAD_SHAPE")
+RIDE_SYNC_INTERVAL = float(os.getenv("RIDE_SYNC_INTERVAL", "0.5"))
+
+class OpenRides:
+    """Rides requested by this run's passengers and not yet finished with.
+
+    Drivers only claim these, so pending rides left over from earlier runs
+    don't steal drivers from the passengers waiting now. On a worker, local
+    changes are also queued for the other workers.
+    """
+
+    def __init__(self):
+        self.ids = set()
+        self.unsent = None
+
+    def __contains__(self, ride_id):
+        return ride_id in self.ids
+
+    def share(self):
+        self.unsent = {"opened": [], "closed": []}
+
+    def add(self, ride_id):
+        self.ids.add(ride_id)
+        if self.unsent is not None:
+            self.unsent["opened"].append(ride_id)
+
+    def discard(self, ride_id):
+        self.ids.discard(ride_id)
+        if self.unsent is not None:
+            self.unsent["closed"].append(ride_id)
+
+    def apply(self, changes):
+        self.ids.update(changes["opened"])
+        self.ids.difference_update(changes["closed"])
+
+    def take_unsent(self):
+        changes, self.unsent = self.unsent, {"opened": [], "closed": []}
+        return changes if changes["opened"] or changes["closed"] else None
+
+open_rides = OpenRides()
+
+def send_ride_changes(runner):
+    while True:
+        gevent.sleep(RIDE_SYNC_INTERVAL)
+        changes = open_rides.take_unsent()
+        if changes:
+            runner.send_message("ride_changes", changes)
+
+def relay_ride_changes(environment, msg, **kwargs):
+    # not back to the sender, which has them already and may have closed an opened ride since
+    for worker in environment.runner.clients.all:
+        if worker.id != msg.node_id:
+            environment.runner.send_message("ride_changes", msg.data, client_id=worker.id)
+
+def apply_ride_changes(environment, msg, **kwargs):
+    open_rides.apply(msg.data)
+
+@events.init.add_listener
+def share_open_rides(environment, **kwargs):
+    if isinstance(environment.runner, MasterRunner):
+        environment.runner.register_message("ride_changes", relay_ride_changes)
+    elif isinstance(environment.runner, WorkerRunner):
+        open_rides.share()
+        environment.runner.register_message("ride_changes", apply_ride_changes)
+        gevent.spawn(send_ride_changes, environment.runner)
+
+def elapsed_ms(start, end):
+    return (datetime.fromisoformat(end) - datetime.fromisoformat(start)).total_seconds() * 1000
 
 class PassengerUser(HttpUser):
-    wait_time = between(1, 3)
-    host = "http://passenger-service:8001"
+    host = PASSENGER_API
+    weight = int(os.getenv("PASSENGER_WEIGHT", "3"))
+    # think time between finishing one ride and requesting the next
+    wait_time = between(1, 5)
+
+    def on_start(self):
+        res = self.client.post("/passengers", json={"name": f"load-{uuid.uuid4().hex[:12]}"})
+        res.raise_for_status()
+        self.passenger_id = res.json()["passenger_id"]
+
+    @task
+    def take_ride(self):
+        with self.client.post("/request_ride", json={"passenger_id": self.passenger_id}, catch_response=True) as res:
+            if res.status_code != 200:
+                res.failure(f"request_ride returned {res.status_code}")
+                return
+            ride_id = res.json()["ride_id"]
+        open_rides.add(ride_id)
+        try:
+            self.wait_for(ride_id)
+        finally:
+            open_rides.discard(ride_id)
 
-    @task(5)
-    def request_ride(self):
-        passenger_id = random.randint(1, 10)
-        self.client.post("/request_ride", json={"passenger_id": passenger_id})
+    def wait_for(self, ride_id):
+        deadline = time.monotonic() + RIDE_TIMEOUT
+        accepted = False
+        while time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            res = self.client.get(f"/ride_status/{ride_id}", name="/ride_status/[ride_id]")
+            if res.status_code != 200:
+                continue
+            ride = res.json()
+            if ride["accepted_at"] and not accepted:
+                accepted = True
+                self.report("time_to_accept", elapsed_ms(ride["requested_at"], ride["accepted_at"]))
+            if ride["status"] == "completed":
+                self.report("time_to_complete", elapsed_ms(ride["requested_at"], ride["completed_at"]))
+                return
+        self.report("time_to_complete", RIDE_TIMEOUT * 1000, TimeoutError(f"ride {ride_id} not completed"))
+        if not accepted:
+            self.report("time_to_accept", RIDE_TIMEOUT * 1000, TimeoutError(f"ride {ride_id} not accepted"))
 
-    @task(2)
-    def check_status(self):
-        ride_id = random.randint(1, 50)
-        self.client.get(f"/ride_status/{ride_id}")
+    def report(self, name, response_time, exception=None):
+        self.environment.events.request.fire(request_type="ride", name=name, response_time=response_time,
+                                             response_length=0, exception=exception, context={})
 
 class DriverUser(HttpUser):
-    wait_time = between(1, 3)
-    host = "http://driver-service:8002"
+    host = DRIVER_API
+    weight = int(os.getenv("DRIVER_WEIGHT", "1"))
+    # back-off between looks at the ride list when nothing was claimed
+    wait_time = between(0.5, 2)
 
-    @task(3)
-    def list_and_accept(self):
-        # fetch available rides and attempt to accept a random one
+    def on_start(self):
+        res = self.client.post("/drivers", json={"name": f"load-{uuid.uuid4().hex[:12]}"})
+        res.raise_for_status()
+        self.driver_id = res.json()["driver_id"]
+
+    @task
+    def drive(self):
         res = self.client.get("/available_rides")
-        if res.status_code == 200 and res.json():
-            rides = res.json()
-            if rides:
-                ride = random.choice(rides)
-                ride_id = ride.get("id")
-                driver_id = random.randint(1, 5)
-                self.client.post(f"/accept_ride/{ride_id}", params={"driver_id": driver_id})
-
-    @task(1)
-    def complete_random(self):
-        ride_id = random.randint(1, 50)
-        driver_id = random.randint(1, 5)
-        self.client.post(f"/complete_ride/{ride_id}", params={"driver_id": driver_id})
+        if res.status_code != 200:
+            return
+        ride_ids = [ride["id"] for ride in res.json() if ride["id"] in open_rides]
+        if not ride_ids:
+            return
+        # a random pick rather than the first, so drivers don't all race for the same ride
+        ride_id = random.choice(ride_ids)
+        with self.client.post(f"/accept_ride/{ride_id}", params={"driver_id": self.driver_id},
+                              name="/accept_ride/[ride_id]", catch_response=True) as res:
+            if res.status_code == 400:
+                # another driver got there first; expected, but kept on its own stats line
+                res.success()
+                res.request_meta["name"] = "/accept_ride/[ride_id] (taken)"
+                return
+            if res.status_code != 200:
+                res.failure(f"accept_ride returned {res.status_code}")
+                return
+
+        time.sleep(random.uniform(TRIP_MIN, TRIP_MAX))
+        self.client.post(f"/complete_ride/{ride_id}", params={"driver_id": self.driver_id},
+                         name="/complete_ride/[ride_id]")
+
+if LOAD_SHAPE:
+    # locust runs the LoadTestShape class it finds in this module, so only the chosen one is bound here
+    Shape = shapes.SHAPES[LOAD_SHAPE]
@@ -0,0 +1,174 @@
+# locust/shapes.py
+"""Load shapes for the ride lifecycle test, picked by name with LOAD_SHAPE.
+
+- step: STEP_USERS more users every STEP_TIME seconds, STEP_COUNT times, to
+  find where latency falls over
+- spike: SPIKE_BASE_USERS, then SPIKE_USERS all at once for SPIKE_HOLD
+  seconds, then back down, like a venue emptying
+- soak: SOAK_USERS held for SOAK_HOURS, for leaks and slow drift
+
+Every shape splits its run into phases (a step, the spike, an hour of soak).
+When the test stops, a table of throughput and latency per phase is printed,
+along with the knee: the first phase whose p99 over the HTTP endpoints
+exceeds SLO_P99_MS. SHAPE_REPORT names a file to also write it to as JSON.
+
+In a distributed run the shape ticks on the master while the requests happen
+on the workers. Workers send their samples along with their regular stats
+reports, and the master files them under the phase current when they arrive,
+so a phase boundary is blurred by up to one report interval (3 s).
+"""
+import json
+import math
+import os
+import time
+from collections import Counter
+from locust import LoadTestShape, events
+from locust.runners import WorkerRunner
+
+SLO_P99_MS = float(os.getenv("SLO_P99_MS", "500"))
+SHAPE_REPORT = os.getenv("SHAPE_REPORT")
+# a phase with fewer requests than this has no meaningful p99
+MIN_PHASE_REQUESTS = int(os.getenv("MIN_PHASE_REQUESTS", "100"))
+
+def percentile(histogram, count, q):
+    target = math.ceil(count * q)
+    seen = 0
+    for ms in sorted(histogram):
+        seen += histogram[ms]
+        if seen >= target:
+            return ms
+    return 0
+
+class PhasedShape(LoadTestShape):
+    """Base for shapes that label each tick with a phase and report latency per phase."""
+
+    abstract = True
+
+    def __init__(self):
+        super().__init__()
+        self.phases = {}
+        self.current = None
+        # a worker's samples not yet reported to the master
+        self.unreported = self.new_samples()
+        events.request.add_listener(self.on_request)
+        events.report_to_master.add_listener(self.on_report_to_master)
+        events.worker_report.add_listener(self.on_worker_report)
+        events.test_stop.add_listener(self.on_test_stop)
+
+    @staticmethod
+    def new_samples():
+        return {"requests": 0, "failures": 0, "histogram": Counter()}
+
+    def plan(self, run_time):
+        """Returns (phase, users, spawn_rate) for this point in the run, or None to stop."""
+        raise NotImplementedError
+
+    def tick(self):
+        planned = self.plan(self.get_run_time())
+        if planned is None:
+            return None
+        phase, users, spawn_rate = planned
+        if phase not in self.phases:
+            self.phases[phase] = {"users": users, "start": time.time(), "end": time.time(), **self.new_samples()}
+        self.current = self.phases[phase]
+        return users, spawn_rate
+
+    def on_request(self, request_type, response_time, exception, **kwargs):
+        # the locustfile's ride timings aren't requests and have their own scale
+        samples = self.unreported if isinstance(self.runner, WorkerRunner) else self.current
+        if samples is None or request_type == "ride":
+            return
+        samples["requests"] += 1
+        samples["failures"] += exception is not None
+        samples["histogram"][round(response_time)] += 1
+        samples["end"] = time.time()
+
+    def on_report_to_master(self, client_id, data, **kwargs):
+        if self.unreported["requests"]:
+            data["phase_samples"], self.unreported = self.unreported, self.new_samples()
+
+    def on_worker_report(self, client_id, data, **kwargs):
+        samples = data.get("phase_samples")
+        if self.current is None or not samples:
+            return
+        self.current["requests"] += samples["requests"]
+        self.current["failures"] += samples["failures"]
+        self.current["histogram"].update(samples["histogram"])
+        self.current["end"] = time.time()
+
+    def summary(self):
+        rows = []
+        for name, phase in self.phases.items():
+            count = phase["requests"]
+            rows.append({"phase": name, "users": phase["users"], "requests": count, "failures": phase["failures"],
+                         "rps": count / max(phase["end"] - phase["start"], 1),
+                         "p50": percentile(phase["histogram"], count, 0.5), "p99": percentile(phase["histogram"], count, 0.99)})
+        knee = next((row for row in rows if row["requests"] >= MIN_PHASE_REQUESTS and row["p99"] > SLO_P99_MS), None)
+        return {"shape": type(self).__name__, "slo_p99_ms": SLO_P99_MS, "phases": rows, "knee": knee}
+
+    def on_test_stop(self, **kwargs):
+        if isinstance(self.runner, WorkerRunner):
+            return
+        summary = self.summary()
+        print(f"\n{'phase':<20}{'users':>7}{'requests':>10}{'fails':>7}{'req/s':>8}{'p50':>7}{'p99':>7}")
+        for row in summary["phases"]:
+            print(f"{row['phase']:<20}{row['users']:>7}{row['requests']:>10}{row['failures']:>7}{row['rps']:>8.1f}"
+                  f"{row['p50']:>7}{row['p99']:>7}")
+        knee = summary["knee"]
+        if knee is None:
+            print(f"p99 stayed within the {SLO_P99_MS:.0f} ms SLO in every phase")
+        else:
+            print(f"Knee: p99 first exceeded {SLO_P99_MS:.0f} ms in phase {knee['phase']} "
+                  f"({knee['users']} users, {knee['rps']:.1f} req/s, p99 {knee['p99']} ms)")
+        if SHAPE_REPORT:
+            with open(SHAPE_REPORT, "w") as f:
+                json.dump(summary, f, indent=2)
+
+class StepShape(PhasedShape):
+    users = int(os.getenv("STEP_USERS", "50"))
+    step_time = float(os.getenv("STEP_TIME", "60"))
+    steps = int(os.getenv("STEP_COUNT", "10"))
+    spawn_rate = float(os.getenv("STEP_SPAWN_RATE", "10"))
+
+    def plan(self, run_time):
+        step = int(run_time // self.step_time)
+        if step >= self.steps:
+            return None
+        users = (step + 1) * self.users
+        return f"{users} users", users, self.spawn_rate
+
+class SpikeShape(PhasedShape):
+    base_users = int(os.getenv("SPIKE_BASE_USERS", "50"))
+    spike_users = int(os.getenv("SPIKE_USERS", "500"))
+    # seconds of baseline before the spike, of the spike itself and of recovery after it
+    spike_at = float(os.getenv("SPIKE_AT", "120"))
+    hold = float(os.getenv("SPIKE_HOLD", "60"))
+    recovery = float(os.getenv("SPIKE_RECOVERY", "180"))
+    # high enough that the spike arrives within a couple of seconds
+    spawn_rate = float(os.getenv("SPIKE_SPAWN_RATE", "250"))
+
+    def plan(self, run_time):
+        if run_time < self.spike_at:
+            return "baseline", self.base_users, self.spawn_rate
+        if run_time < self.spike_at + self.hold:
+            return "spike", self.spike_users, self.spawn_rate
+        if run_time < self.spike_at + self.hold + self.recovery:
+            return "recovery", self.base_users, self.spawn_rate
+        return None
+
+class SoakShape(PhasedShape):
+    users = int(os.getenv("SOAK_USERS", "200"))
+    hours = float(os.getenv("SOAK_HOURS", "4"))
+    ramp = float(os.getenv("SOAK_RAMP", "300"))
+    # latency is reported per window so drift over the run shows up
+    window = float(os.getenv("SOAK_WINDOW", "1800"))
+
+    def plan(self, run_time):
+        if run_time >= self.ramp + self.hours * 3600:
+            return None
+        if run_time < self.ramp:
+            return "ramp", self.users, self.users / self.ramp
+        start = (run_time - self.ramp) // self.window * self.window
+        return f"{start / 60:.0f}-{(start + self.window) / 60:.0f} min", self.users, self.users / self.ramp
+
+SHAPES = {"step": StepShape, "spike": SpikeShape, "soak": SoakShape}
@@ -1,43 +1,30 @@
 # passenger-service/app.py
-from fastapi import FastAPI, HTTPException
+from fastapi import HTTPException
 from pydantic import BaseModel
-import psycopg2
 from psycopg2.extras import RealDictCursor
-import os
 import logging
-from pythonjsonlogger import jsonlogger
-from opentelemetry import trace
-from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-from opentelemetry.sdk.resources import Resource
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.exporter.jaeger.thrift import JaegerExporter
+import os
+from prometheus_client import Counter
+from taxi_common.bootstrap import create_app
+from taxi_common.db import connection, execute, warm_pool
 
-# Logging
 SERVICE_NAME = "passenger-service"
 logger = logging.getLogger(SERVICE_NAME)
-log_path = f"/tmp/{SERVICE_NAME}.log"
-file_handler = logging.FileHandler(log_path)
-formatter = jsonlogger.JsonFormatter('%(asctime)s %(name)s %(levelname)s %(message)s trace_id=%(trace_id)s span_id=%(span_id)s')
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-logger.addHandler(logging.StreamHandler())
-logger.setLevel(logging.INFO)
+# the compose file mounts /tmp as this service's directory under logs/
+log_dir = os.getenv("LOG_DIR", "/tmp")
+
+# ride_routes gives the partition key, so only the ride's own month is scanned
+SELECT_RIDE = "SELECT * FROM rides WHERE id=%s AND requested_at=(SELECT requested_at FROM ride_routes WHERE id=%s)"
 
-# Tracing
-resource = Resource.create({"service.name": SERVICE_NAME})
-provider = TracerProvider(resource=resource)
-jaeger_exporter = JaegerExporter(collector_endpoint=os.getenv("JAEGER_COLLECTOR", "http://jaeger:14268/api/traces"))
-provider.add_span_processor(BatchSpanProcessor(jaeger_exporter))
-trace.set_tracer_provider(provider)
+def warmup():
+    # the hot reads, run once on every pooled connection so each backend has its catalog cached
+    warm_pool([("select_passenger", "SELECT id FROM passengers WHERE id=%s", (0,)),
+               ("select_ride", SELECT_RIDE, (0, 0))])
 
-app = FastAPI()
-FastAPIInstrumentor.instrument_app(app)
+app = create_app(SERVICE_NAME, os.path.join(log_dir, f"{SERVICE_NAME}.log"), db=True, warmup=warmup)
 
-DB_HOST = os.getenv("DB_HOST", "db")
-DB_NAME = os.getenv("DB_NAME", "taxi_db")
-DB_USER = os.getenv("DB_USER", "postgres")
-DB_PASS = os.getenv("DB_PASS", "postgres")
+# Metrics
+RIDES_REQUESTED = Counter("rides_requested_total", "Rides requested by passengers")
 
 class Passenger(BaseModel):
     name: str
@@ -45,63 +32,41 @@ class Passenger(BaseModel):
 class RideRequest(BaseModel):
     passenger_id: int
 
-def get_db_conn():
-    return psycopg2.connect(host=DB_HOST, dbname=DB_NAME, user=DB_USER, password=DB_PASS)
-
-def get_trace_context():
-    span = trace.get_current_span()
-    if span and span.get_span_context().trace_id != 0:
-        return (format(span.get_span_context().trace_id, '032x'), format(span.get_span_context().span_id, '016x'))
-    return (None, None)
-
 @app.post("/passengers")
 def create_passenger(p: Passenger):
-    trace_id, span_id = get_trace_context()
-    logger.info(f"Creating passenger {p.name}", extra={"trace_id": trace_id, "span_id": span_id})
-    conn = get_db_conn()
-    cur = conn.cursor()
-    cur.execute("INSERT INTO passengers (name) VALUES (%s) RETURNING id", (p.name,))
-    passenger_id = cur.fetchone()[0]
-    conn.commit()
-    cur.close()
-    conn.close()
-    logger.info(f"Created passenger id={passenger_id}", extra={"trace_id": trace_id, "span_id": span_id})
+    logger.info("Creating passenger %s", p.name)
+    with connection() as conn, conn.cursor() as cur:
+        execute(cur, "insert_passenger", "INSERT INTO passengers (name) VALUES (%s) RETURNING id", (p.name,))
+        passenger_id = cur.fetchone()[0]
+        conn.commit()
+    logger.info("Created passenger id=%s", passenger_id)
     return {"passenger_id": passenger_id, "name": p.name}
 
 @app.post("/request_ride")
 def request_ride(ride_req: RideRequest):
-    trace_id, span_id = get_trace_context()
-    logger.info(f"Ride requested for passenger {ride_req.passenger_id}", extra={"trace_id": trace_id, "span_id": span_id})
+    logger.info("Ride requested for passenger %s", ride_req.passenger_id)
 
-    conn = get_db_conn()
-    cur = conn.cursor()
-    # ensure passenger exists
-    cur.execute("SELECT id FROM passengers WHERE id=%s", (ride_req.passenger_id,))
-    if cur.fetchone() is None:
-        cur.close()
-        conn.close()
-        logger.warning("Passenger not found", extra={"trace_id": trace_id, "span_id": span_id})
-        raise HTTPException(status_code=404, detail="Passenger not found")
-    cur.execute("INSERT INTO rides (passenger_id, status) VALUES (%s, 'pending') RETURNING id", (ride_req.passenger_id,))
-    ride_id = cur.fetchone()[0]
-    conn.commit()
-    cur.close()
-    conn.close()
-    logger.info(f"Created ride with id {ride_id}", extra={"trace_id": trace_id, "span_id": span_id})
+    with connection() as conn, conn.cursor() as cur:
+        # ensure passenger exists
+        execute(cur, "select_passenger", "SELECT id FROM passengers WHERE id=%s", (ride_req.passenger_id,))
+        if cur.fetchone() is None:
+            logger.warning("Passenger not found")
+            raise HTTPException(status_code=404, detail="Passenger not found")
+        execute(cur, "insert_ride", "INSERT INTO rides (passenger_id, status) VALUES (%s, 'pending') RETURNING id", (ride_req.passenger_id,))
+        ride_id = cur.fetchone()[0]
+        conn.commit()
+    RIDES_REQUESTED.inc()
+    logger.info("Created ride with id %s", ride_id)
     return {"ride_id": ride_id, "status": "pending"}
 
 @app.get("/ride_status/{ride_id}")
 def ride_status(ride_id: int):
-    trace_id, span_id = get_trace_context()
-    conn = get_db_conn()
-    cur = conn.cursor(cursor_factory=RealDictCursor)
-    cur.execute("SELECT * FROM rides WHERE id=%s", (ride_id,))
-    ride = cur.fetchone()
-    cur.close()
-    conn.close()
+    with connection() as conn, conn.cursor(cursor_factory=RealDictCursor) as cur:
+        execute(cur, "select_ride", SELECT_RIDE, (ride_id, ride_id))
+        ride = cur.fetchone()
     if ride:
-        logger.info(f"Ride status requested for id {ride_id}", extra={"trace_id": trace_id, "span_id": span_id})
+        logger.info("Ride status requested for id %s", ride_id)
         return ride
     else:
-        logger.warning(f"Ride id {ride_id} not found", extra={"trace_id": trace_id, "span_id": span_id})
+        logger.warning("Ride id %s not found", ride_id)
         raise HTTPException(status_code=404, detail="Ride not found")
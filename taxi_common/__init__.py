@@ -0,0 +1,6 @@
+# taxi_common/__init__.py
+"""Logging, tracing, metrics, profiling and DB helpers shared by the taxi services.
+
+Kept import-free: gunicorn_conf is loaded through this package and must run
+before prometheus_client creates any metric.
+"""
@@ -0,0 +1,161 @@
+# taxi_common/bootstrap.py
+import asyncio
+import contextlib
+import hmac
+import logging
+import os
+import threading
+import time
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, PlainTextResponse
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, generate_latest, multiprocess
+from .capture import CAPTURE_PATH, CaptureMiddleware, capture_logger, setup_capture
+from .logs import setup_logging
+from .metrics import InstrumentedRoute, MetricsMiddleware, monitor_event_loop
+from .shutdown import drain_threads, flip_readiness_on_sigterm
+from .profiling import PROFILE_TOKEN, STACK_SAMPLER_HZ, STACK_SAMPLER_MAX_STACKS, ProfileMiddleware, StackSampler
+from .tracing import instrument, setup_tracing
+
+# how long startup holds a worker back from accepting while it warms up; past this it serves
+# with /readyz failing until warm-up finishes, so a database outage cannot wedge startup
+WARMUP_TIMEOUT = float(os.getenv("WARMUP_TIMEOUT", "10"))
+# how long warm-up keeps retrying before the worker exits; 0 retries forever
+WARMUP_GIVE_UP = float(os.getenv("WARMUP_GIVE_UP", "120"))
+# gunicorn's WORKER_BOOT_ERROR: the master stops instead of forking replacements that would fail the same way
+WARMUP_FAILED_EXIT = 3
+# bounded so an unreachable collector cannot eat the rest of the shutdown budget
+SPAN_FLUSH_TIMEOUT_MS = int(os.getenv("SPAN_FLUSH_TIMEOUT_MS", "3000"))
+
+def warm_up(app, logger, db, warmup, stopping):
+    delay = 0.5
+    while True:
+        try:
+            if db:
+                from .db import open_pool
+                open_pool()
+            if warmup is not None:
+                warmup()
+            break
+        except Exception as e:
+            waited = time.perf_counter() - app.state.started
+            if WARMUP_GIVE_UP > 0 and waited + delay > WARMUP_GIVE_UP:
+                logger.error("Warm-up still failing after %.0fs, giving up: %r", waited, e, exc_info=True)
+                # flushes the queued log handlers; a normal exit would wait for the server, which is up and serving 503s
+                logging.shutdown()
+                os._exit(WARMUP_FAILED_EXIT)
+            logger.warning("Warm-up failed, retrying in %.1fs", delay, exc_info=True)
+            if stopping.wait(delay):
+                return
+            delay = min(delay * 2, 10)
+    app.state.ready = True
+    logger.info("Ready after %.0f ms", (time.perf_counter() - app.state.started) * 1000)
+
+def create_app(service_name, log_path, db=False, warmup=None, **kwargs):
+    """FastAPI app with the shared middleware, health and admin routes.
+
+    Log handlers, the tracer provider and background threads are created in
+    lifespan rather than at import, so importing the app stays cheap and
+    nothing threaded exists before a process manager forks workers. With
+    `db`, lifespan opens the connection pool; `warmup` is then called on a
+    thread, retried until it succeeds, before /readyz reports ready. Past
+    WARMUP_GIVE_UP the worker exits with gunicorn's boot error code.
+    """
+    logger = logging.getLogger(service_name)
+
+    @contextlib.asynccontextmanager
+    async def lifespan(app):
+        # one file per gunicorn worker slot, rotation is only safe with a single writer
+        slot = os.getenv("WORKER_SLOT")
+        path = log_path if slot is None else log_path.replace(".log", f"-{slot}.log")
+        # (logger, handler) pairs, detached again at shutdown so a later lifespan in this process starts clean
+        handlers = [(logger, setup_logging(logger, path))]
+        if db:
+            from .db import setup_slow_query_log, slow_query_logger
+            handlers.append((slow_query_logger, setup_slow_query_log(path.replace(".log", "-slow.log"))))
+        if CAPTURE_PATH:
+            handlers.append((capture_logger, setup_capture(CAPTURE_PATH if slot is None else CAPTURE_PATH.replace(".jsonl", f"-{slot}.jsonl"))))
+        # exporter imports run on a worker thread; spans before it finishes are no-ops
+        provider = asyncio.get_running_loop().run_in_executor(None, setup_tracing, service_name)
+        loop_monitor = asyncio.create_task(monitor_event_loop())
+        app.state.stack_sampler = StackSampler(STACK_SAMPLER_HZ, STACK_SAMPLER_MAX_STACKS) if STACK_SAMPLER_HZ > 0 else None
+        if app.state.stack_sampler is not None:
+            app.state.stack_sampler.start()
+        app.state.ready = False
+        app.state.started = time.perf_counter()
+        stopping = threading.Event()
+        warmer = threading.Thread(target=warm_up, args=(app, logger, db, warmup, stopping), name="warm-up", daemon=True)
+        warmer.start()
+        if db:
+            from .partitions import PARTITION_MAINTENANCE_INTERVAL, run_partition_maintenance
+            if PARTITION_MAINTENANCE_INTERVAL > 0 and slot in (None, "0"):
+                # one worker per service, not all of them holding a connection for it; the services
+                # still overlap, an advisory lock leaves the work to one at a time
+                threading.Thread(target=run_partition_maintenance, args=(logger, stopping), name="partition-maintenance",
+                                 daemon=True).start()
+        await asyncio.get_running_loop().run_in_executor(None, warmer.join, WARMUP_TIMEOUT)
+        flip_readiness_on_sigterm(app)
+        try:
+            yield
+        finally:
+            # by now the server has stopped accepting and drained, or given up on, open requests
+            app.state.ready = False
+            stopping.set()
+            loop_monitor.cancel()
+            stragglers = await drain_threads()
+            if stragglers:
+                logger.warning("Shutting down with %s handler threads still running", stragglers)
+            if db:
+                from .db import close_pool
+                warmer.join(WARMUP_TIMEOUT)
+                close_pool()
+            provider = await provider
+            if provider is not None:
+                provider.force_flush(SPAN_FLUSH_TIMEOUT_MS)
+                provider.shutdown()
+            logger.info("Shutdown complete")
+            # last, so everything above is still logged
+            for owner, handler in handlers:
+                owner.removeHandler(handler)
+                handler.close()
+
+    app = FastAPI(lifespan=lifespan, **kwargs)
+    app.router.route_class = InstrumentedRoute
+    app.add_middleware(MetricsMiddleware)
+    instrument(app)
+    if PROFILE_TOKEN:
+        app.add_middleware(ProfileMiddleware)
+    if CAPTURE_PATH:
+        app.add_middleware(CaptureMiddleware, service=service_name)
+
+    registry = REGISTRY
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        # whichever worker serves the scrape reports every worker's samples
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+
+    @app.get("/healthz")
+    async def healthz():
+        # liveness only needs the event loop to answer
+        return {"status": "ok"}
+
+    @app.get("/readyz")
+    async def readyz(request: Request):
+        if not request.app.state.ready:
+            return JSONResponse({"status": "warming up"}, status_code=503)
+        return {"status": "ready"}
+
+    @app.get("/metrics")
+    async def metrics():
+        return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
+
+    @app.get("/admin/flamegraph")
+    def flamegraph(request: Request, reset: bool = False):
+        # same secret as per-request profiling; the sampler is off unless STACK_SAMPLER_HZ is set
+        token = request.headers.get("x-profile", "")
+        if not PROFILE_TOKEN or not hmac.compare_digest(token, PROFILE_TOKEN):
+            raise HTTPException(status_code=403, detail="Forbidden")
+        if getattr(request.app.state, "stack_sampler", None) is None:
+            raise HTTPException(status_code=404, detail="Stack sampler disabled")
+        return PlainTextResponse(request.app.state.stack_sampler.collapsed(reset))
+
+    return app
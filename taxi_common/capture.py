@@ -0,0 +1,108 @@
+# taxi_common/capture.py
+"""Sampled request capture for bench/replay.py, off unless CAPTURE_PATH is set.
+
+One JSON line per request: service, method, route template, path, query
+params, JSON body, status, arrival time and duration, plus the *_id fields
+of a small JSON response so replay can map captured ids to the ones its own
+requests create. Values of CAPTURE_REDACT fields are replaced wherever they
+appear; headers are never kept.
+"""
+import json
+import logging
+import os
+import random
+import time
+from urllib.parse import parse_qsl
+from .logs import QueuedLogHandler, RotatingLogFile
+
+CAPTURE_PATH = os.getenv("CAPTURE_PATH")
+CAPTURE_SAMPLE_RATE = float(os.getenv("CAPTURE_SAMPLE_RATE", "1"))
+# bodies above this are not kept, only their size
+CAPTURE_MAX_BODY = int(os.getenv("CAPTURE_MAX_BODY", "4096"))
+CAPTURE_REDACT = frozenset(filter(None, os.getenv("CAPTURE_REDACT", "name,email,phone,password,token").split(",")))
+CAPTURE_EXCLUDE = ("/metrics", "/healthz", "/readyz", "/admin/")
+capture_logger = logging.getLogger("traffic_capture")
+capture_logger.propagate = False
+
+class CaptureFormatter(logging.Formatter):
+    # the entry is encoded here, on the log writer thread
+    def format(self, record):
+        return json.dumps(record.msg, separators=(",", ":"))
+
+def setup_capture(path):
+    file_handler = RotatingLogFile(path)
+    file_handler.setFormatter(CaptureFormatter())
+    handler = QueuedLogHandler([file_handler])
+    capture_logger.addHandler(handler)
+    capture_logger.setLevel(logging.INFO)
+    return handler
+
+def redact(value):
+    if isinstance(value, dict):
+        return {k: "redacted" if k in CAPTURE_REDACT else redact(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [redact(v) for v in value]
+    return value
+
+def parse_json(chunks, size):
+    if not chunks or size > CAPTURE_MAX_BODY:
+        return None
+    try:
+        return json.loads(b"".join(chunks))
+    except ValueError:
+        return None
+
+class CaptureMiddleware:
+    def __init__(self, app, service):
+        self.app = app
+        self.service = service
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or scope["path"].startswith(CAPTURE_EXCLUDE)
+                or random.random() >= CAPTURE_SAMPLE_RATE):
+            await self.app(scope, receive, send)
+            return
+        request_chunks, response_chunks = [], []
+        request_size = response_size = 0
+        status = 500
+
+        async def receive_and_keep():
+            nonlocal request_size
+            message = await receive()
+            if message["type"] == "http.request":
+                request_size += len(message.get("body", b""))
+                if request_size <= CAPTURE_MAX_BODY:
+                    request_chunks.append(message.get("body", b""))
+            return message
+
+        async def send_and_keep(message):
+            nonlocal status, response_size
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+                if response_size <= CAPTURE_MAX_BODY:
+                    response_chunks.append(message.get("body", b""))
+            await send(message)
+
+        arrived = time.time()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive_and_keep, send_and_keep)
+        finally:
+            route = scope.get("route")
+            entry = {"ts": round(arrived, 6), "service": self.service, "method": scope["method"],
+                     "route": route.path if route else None, "path": scope["path"],
+                     "params": redact(dict(parse_qsl(scope["query_string"].decode("latin-1")))),
+                     "status": status, "duration_ms": round((time.perf_counter() - start) * 1000, 3)}
+            body = parse_json(request_chunks, request_size)
+            if body is not None:
+                entry["body"] = redact(body)
+            elif request_size:
+                entry["body_bytes"] = request_size
+            response = parse_json(response_chunks, response_size)
+            if isinstance(response, dict):
+                ids = {k: v for k, v in response.items() if k.endswith("_id") and isinstance(v, int)}
+                if ids:
+                    entry["ids"] = ids
+            capture_logger.info(entry)
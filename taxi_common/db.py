@@ -0,0 +1,178 @@
+# taxi_common/db.py
+import contextlib
+import logging
+import os
+import random
+import threading
+import time
+import psycopg2
+import psycopg2.pool
+from prometheus_client import Gauge, Histogram
+from opentelemetry import trace
+from opentelemetry.trace import SpanKind
+from .logs import QueuedLogHandler, RotatingLogFile, TraceContextFilter, formatter
+
+DB_HOST = os.getenv("DB_HOST", "db")
+DB_NAME = os.getenv("DB_NAME", "taxi_db")
+DB_USER = os.getenv("DB_USER", "postgres")
+DB_PASS = os.getenv("DB_PASS", "postgres")
+# connections one service may hold across all its workers, split evenly between them; every service's budget
+# plus admin sessions has to fit under Postgres's max_connections (100 by default)
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "40"))
+# per worker process, overriding the share of DB_MAX_CONNECTIONS when set; psycopg2's pool closes anything
+# returned above minconn, so min and max are the same
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "0"))
+
+DB_QUERY_LATENCY = Histogram("db_query_duration_seconds", "DB statement latency", ["statement"],
+                             buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5))
+DB_CONNECT_LATENCY = Histogram("db_connect_duration_seconds", "DB connection setup latency")
+DB_POOL_WAIT = Histogram("db_pool_wait_seconds", "Time spent waiting for a pooled DB connection",
+                         buckets=(.0001, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5))
+DB_CONNECTIONS_OPEN = Gauge("db_connections_open", "DB connections currently checked out", multiprocess_mode="livesum")
+
+# Slow queries go to their own structured log, optionally with the plan
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+SLOW_QUERY_EXPLAIN_RATE = float(os.getenv("SLOW_QUERY_EXPLAIN_RATE", "0"))
+slow_query_logger = logging.getLogger("slow_query")
+slow_query_logger.propagate = False
+
+def setup_slow_query_log(log_path):
+    file_handler = RotatingLogFile(log_path)
+    file_handler.setFormatter(formatter)
+    handler = QueuedLogHandler([file_handler])
+    handler.addFilter(TraceContextFilter())
+    slow_query_logger.addHandler(handler)
+    return handler
+
+class ConnectionPool(psycopg2.pool.ThreadedConnectionPool):
+    """Fixed-size pool that blocks for a free connection instead of raising PoolError when exhausted."""
+
+    def __init__(self, size):
+        self.size = size
+        self.slots = threading.BoundedSemaphore(size)
+        try:
+            super().__init__(size, size, host=DB_HOST, dbname=DB_NAME, user=DB_USER, password=DB_PASS)
+        except Exception:
+            # the connections opened before the failure, or every retry would leak a few more; the lock
+            # doesn't exist yet, and nothing else has the pool
+            self._closeall()
+            raise
+
+    def _connect(self, key=None):
+        # also runs to replace connections the pool found broken
+        start = time.perf_counter()
+        conn = super()._connect(key)
+        DB_CONNECT_LATENCY.observe(time.perf_counter() - start)
+        return conn
+
+    def getconn(self):
+        start = time.perf_counter()
+        self.slots.acquire()
+        try:
+            conn = super().getconn()
+        except Exception:
+            self.slots.release()
+            raise
+        DB_POOL_WAIT.observe(time.perf_counter() - start)
+        return conn
+
+    def putconn(self, conn, close=False):
+        try:
+            super().putconn(conn, close=close)
+        finally:
+            self.slots.release()
+
+pool = None
+
+def pool_size():
+    if DB_POOL_SIZE:
+        return DB_POOL_SIZE
+    # WORKER_COUNT is set by gunicorn's post_fork; a lone process keeps the old default of 10
+    return max(1, min(10, DB_MAX_CONNECTIONS // int(os.getenv("WORKER_COUNT", "1"))))
+
+def open_pool():
+    # called from lifespan, each worker needs its own sockets after the fork
+    global pool
+    if pool is None:
+        pool = ConnectionPool(pool_size())
+    return pool
+
+def close_pool():
+    global pool
+    if pool is not None:
+        pool.closeall()
+        pool = None
+
+def get_db_conn():
+    if pool is None:
+        raise RuntimeError("DB pool is not open yet")
+    conn = pool.getconn()
+    DB_CONNECTIONS_OPEN.inc()
+    return conn
+
+def release_db_conn(conn, close=False):
+    # an open transaction is rolled back by the pool before reuse
+    pool.putconn(conn, close=close)
+    DB_CONNECTIONS_OPEN.dec()
+
+@contextlib.contextmanager
+def connection():
+    conn = get_db_conn()
+    try:
+        yield conn
+    except psycopg2.OperationalError:
+        # the server side is likely gone, don't hand this one out again
+        release_db_conn(conn, close=True)
+        raise
+    except BaseException:
+        release_db_conn(conn)
+        raise
+    else:
+        release_db_conn(conn)
+
+def warm_pool(statements):
+    """Checks out every pooled connection at once and runs each (name, sql, params) read on it."""
+    conns = [get_db_conn() for _ in range(pool.size)]
+    try:
+        for conn in conns:
+            with conn.cursor() as cur:
+                for statement, sql, params in statements:
+                    execute(cur, statement, sql, params)
+                    cur.fetchall()
+            conn.rollback()
+    finally:
+        for conn in conns:
+            release_db_conn(conn)
+
+tracer = trace.get_tracer(__name__)
+
+def execute(cur, statement, sql, params=None):
+    with tracer.start_as_current_span(statement, kind=SpanKind.CLIENT,
+                                      attributes={"db.system": "postgresql", "db.operation": statement, "db.statement": sql}) as span:
+        start = time.perf_counter()
+        cur.execute(sql, params)
+        elapsed = time.perf_counter() - start
+        span.set_attribute("db.row_count", cur.rowcount)
+    DB_QUERY_LATENCY.labels(statement).observe(elapsed)
+    if elapsed * 1000 >= SLOW_QUERY_MS:
+        plan = explain(cur, sql, params) if random.random() < SLOW_QUERY_EXPLAIN_RATE else None
+        slow_query_logger.warning("Slow query %s took %.1f ms", statement, elapsed * 1000,
+                                  extra={"statement": statement, "duration_ms": round(elapsed * 1000, 3),
+                                         "row_count": cur.rowcount, "sql": sql, "plan": plan})
+
+def explain(cur, sql, params):
+    # only reads are re-run under ANALYZE; writes get the estimated plan
+    analyze = sql.lstrip().upper().startswith("SELECT")
+    prefix = "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " if analyze else "EXPLAIN (FORMAT JSON) "
+    # a savepoint keeps a failed EXPLAIN from aborting the request's transaction
+    with cur.connection.cursor() as explain_cur:
+        explain_cur.execute("SAVEPOINT explain_slow_query")
+        try:
+            explain_cur.execute(prefix + sql, params)
+            plan = explain_cur.fetchone()[0]
+        except psycopg2.Error:
+            explain_cur.execute("ROLLBACK TO SAVEPOINT explain_slow_query")
+            slow_query_logger.exception("EXPLAIN failed for slow query")
+            return None
+        explain_cur.execute("RELEASE SAVEPOINT explain_slow_query")
+    return plan
@@ -0,0 +1,55 @@
+# taxi_common/gunicorn_conf.py
+# Production run mode: gunicorn -c python:taxi_common.gunicorn_conf app:app
+import glob
+import math
+import os
+
+def cpu_limit():
+    # cgroup v2 quota first, docker --cpus shows up there rather than in the affinity mask
+    try:
+        with open("/sys/fs/cgroup/cpu.max") as f:
+            quota, period = f.read().split()
+        if quota != "max":
+            return max(1, math.ceil(int(quota) / int(period)))
+    except (OSError, ValueError):
+        pass
+    return len(os.sched_getaffinity(0))
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+worker_class = "taxi_common.workers.DrainingWorker"
+# handlers are sync and run in each worker's threadpool, one event loop per core is enough
+workers = int(os.getenv("WEB_CONCURRENCY", str(cpu_limit())))
+# off, each worker imports the app itself, so SIGHUP's re-forked workers pick up new code. PRELOAD_APP=true
+# imports it once in the master and forks it, which boots workers faster and shares memory, but then SIGHUP
+# only restarts workers on the code the master loaded. Either way, everything threaded starts in lifespan
+preload_app = os.getenv("PRELOAD_APP", "false").lower() == "true"
+# recycle workers to bound slow leaks, jittered so they don't all restart together
+max_requests = int(os.getenv("MAX_REQUESTS", "10000"))
+max_requests_jitter = int(os.getenv("MAX_REQUESTS_JITTER", "1000"))
+# must cover SHUTDOWN_DELAY + DRAIN_TIMEOUT + THREAD_DRAIN_TIMEOUT and the flushes, see taxi_common.shutdown
+graceful_timeout = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("KEEPALIVE", "5"))
+accesslog = None
+
+# counters from a previous run would otherwise be summed into this one. Done here rather than in
+# on_starting because with preload_app the app is imported, and metric files created, before that hook runs
+multiproc_dir = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+if multiproc_dir:
+    os.makedirs(multiproc_dir, exist_ok=True)
+    for path in glob.glob(os.path.join(multiproc_dir, "*.db")):
+        os.remove(path)
+
+def pre_fork(server, worker):
+    # lowest slot no live worker holds, so per-worker log files stay bounded across recycling
+    taken = {getattr(w, "slot", None) for w in server.WORKERS.values()}
+    worker.slot = next(slot for slot in range(len(taken) + 1) if slot not in taken)
+
+def post_fork(server, worker):
+    os.environ["WORKER_SLOT"] = str(worker.slot)
+    # for the limits that are set per service and shared out between its workers
+    os.environ["WORKER_COUNT"] = str(server.num_workers)
+
+def child_exit(server, worker):
+    if multiproc_dir:
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,252 @@
+# taxi_common/logs.py
+import gzip
+import itertools
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import shutil
+import threading
+import time
+from prometheus_client import Counter
+from pythonjsonlogger import jsonlogger
+from opentelemetry import trace
+
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+LOG_BATCH_SIZE = int(os.getenv("LOG_BATCH_SIZE", "256"))
+# rotate on whichever comes first; rotated files past the newest are gzipped, LOG_BACKUP_COUNT are kept.
+# Age rotation falls on multiples of LOG_ROTATE_SECONDS since the epoch (midnight UTC for a day)
+LOG_MAX_BYTES = int(os.getenv("LOG_MAX_BYTES", str(50 * 1024 * 1024)))
+LOG_ROTATE_SECONDS = float(os.getenv("LOG_ROTATE_SECONDS", "86400"))
+LOG_BACKUP_COUNT = int(os.getenv("LOG_BACKUP_COUNT", "7"))
+LOG_COMPRESS = os.getenv("LOG_COMPRESS", "true").lower() == "true"
+LOG_RECORDS_DROPPED = Counter("log_records_dropped_total", "Log records dropped because the log queue was full")
+LOG_RECORDS_SUPPRESSED = Counter("log_records_suppressed_total", "Log records suppressed by sampling", ["rule"])
+def parse_sampling(raw):
+    """Parses LOG_SAMPLING, failing at import on a rule that couldn't sample rather than on its first record."""
+    rules = json.loads(raw)
+    for key, rule in rules.items():
+        unknown = set(rule) - {"every", "rate", "burst"}
+        if unknown:
+            raise ValueError(f"LOG_SAMPLING rule {key!r} has unknown settings {sorted(unknown)}")
+        if not any(isinstance(rule.get(name), (int, float)) and rule[name] > 0 for name in ("every", "rate")):
+            raise ValueError(f"LOG_SAMPLING rule {key!r} needs a positive 'every' or 'rate'")
+    return rules
+
+# e.g. {"Fetched %s available rides": {"every": 100}, "driver-service": {"rate": 50, "burst": 200}}
+LOG_SAMPLING = parse_sampling(os.getenv("LOG_SAMPLING", "{}"))
+LOG_SAMPLING_KEEP_TRACED = os.getenv("LOG_SAMPLING_KEEP_TRACED", "true").lower() == "true"
+
+class RotatingLogFile(logging.handlers.RotatingFileHandler):
+    """Rotates on size or age. The newest backup stays plain so a log shipper can finish reading it."""
+
+    def __init__(self, filename, max_bytes=LOG_MAX_BYTES, interval=LOG_ROTATE_SECONDS,
+                 backup_count=LOG_BACKUP_COUNT, compress=LOG_COMPRESS):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=max(backup_count, 1))
+        self.interval = interval
+        self.compress = compress
+        self.compressor = None
+        self.size = self.stream.tell()
+        # from the existing file's last write, so a process restarted more often than the interval still rotates
+        self.rollover_at = self.next_rollover(os.path.getmtime(self.baseFilename) if self.size else time.time())
+
+    def next_rollover(self, after):
+        return (after // self.interval + 1) * self.interval if self.interval else None
+
+    def write(self, line):
+        # tracks the size itself rather than formatting twice and seeking like shouldRollover;
+        # maxBytes is in bytes, so non-ASCII lines count what they take on disk
+        size = len(line.encode(self.stream.encoding))
+        if self.size and ((self.maxBytes and self.size + size > self.maxBytes)
+                          or (self.rollover_at and time.time() >= self.rollover_at)):
+            self.doRollover()
+        self.stream.write(line)
+        self.size += size
+
+    def emit(self, record):
+        try:
+            self.write(self.format(record) + self.terminator)
+            self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def backup(self, n):
+        return f"{self.baseFilename}.{n}"
+
+    def doRollover(self):
+        if self.stream:
+            self.stream.close()
+            self.stream = None
+        # the shift below must not move a file the compressor is still reading
+        if self.compressor is not None:
+            self.compressor.join()
+        for suffix in ("", ".gz"):
+            if os.path.exists(self.backup(self.backupCount) + suffix):
+                os.remove(self.backup(self.backupCount) + suffix)
+        for n in range(self.backupCount - 1, 0, -1):
+            for suffix in ("", ".gz"):
+                if os.path.exists(self.backup(n) + suffix):
+                    os.replace(self.backup(n) + suffix, self.backup(n + 1) + suffix)
+        if os.path.exists(self.baseFilename):
+            os.replace(self.baseFilename, self.backup(1))
+        self.stream = self._open()
+        self.size = 0
+        self.rollover_at = self.next_rollover(time.time())
+        if self.compress and os.path.exists(self.backup(2)):
+            self.compressor = threading.Thread(target=self.compress_file, args=(self.backup(2),), name="log-compress", daemon=True)
+            self.compressor.start()
+
+    @staticmethod
+    def compress_file(path):
+        with open(path, "rb") as src, gzip.open(path + ".gz.tmp", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.replace(path + ".gz.tmp", path + ".gz")
+        os.remove(path)
+
+    def close(self):
+        if self.compressor is not None:
+            self.compressor.join()
+        super().close()
+
+class QueuedLogHandler(logging.Handler):
+    """Hands records to a background writer so request threads never block on log I/O."""
+
+    def __init__(self, handlers, maxsize=LOG_QUEUE_SIZE, batch_size=LOG_BATCH_SIZE):
+        super().__init__()
+        self.handlers = handlers
+        self.queue = queue.Queue(maxsize)
+        self.batch_size = batch_size
+        self.dropped = 0
+        self.writer = threading.Thread(target=self.run, name="log-writer", daemon=True)
+        self.writer.start()
+
+    def emit(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            LOG_RECORDS_DROPPED.inc()
+
+    def run(self):
+        while True:
+            batch = [self.queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            stop = batch[-1] is None
+            self.write([record for record in batch if record is not None])
+            if stop:
+                return
+
+    def write(self, batch):
+        # one flush per handler per batch instead of one per record
+        for handler in self.handlers:
+            handler.acquire()
+            try:
+                for record in batch:
+                    if record.levelno >= handler.level and handler.filter(record):
+                        line = handler.format(record) + handler.terminator
+                        if isinstance(handler, RotatingLogFile):
+                            handler.write(line)
+                        else:
+                            handler.stream.write(line)
+                handler.flush()
+            except Exception:
+                handler.handleError(batch[-1])
+            finally:
+                handler.release()
+
+    def close(self):
+        if self.writer.is_alive():
+            self.queue.put(None)
+            self.writer.join(timeout=5)
+        for handler in self.handlers:
+            handler.close()
+        super().close()
+
+class TraceContextFilter(logging.Filter):
+    """Attaches the active span context to records that are actually emitted."""
+
+    def filter(self, record):
+        record._span_context = trace.get_current_span().get_span_context()
+        return True
+
+class TraceJsonFormatter(jsonlogger.JsonFormatter):
+    # hex ids are rendered here, on the log writer thread
+    def add_fields(self, log_record, record, message_dict):
+        super().add_fields(log_record, record, message_dict)
+        ctx = getattr(record, "_span_context", None)
+        if ctx is not None and ctx.is_valid:
+            log_record["trace_id"] = format(ctx.trace_id, "032x")
+            log_record["span_id"] = format(ctx.span_id, "016x")
+        else:
+            log_record["trace_id"] = log_record["span_id"] = None
+
+class SampleRule:
+    """Keeps 1 in `every` records, or `rate` records per second with bursts up to `burst`."""
+
+    def __init__(self, key, every=None, rate=None, burst=None):
+        self.every = every
+        self.counter = itertools.count()
+        self.rate = rate
+        self.burst = burst or rate
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+        self.suppressed = LOG_RECORDS_SUPPRESSED.labels(key)
+
+    def allow(self):
+        if self.every:
+            return next(self.counter) % self.every == 0
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return True
+            return False
+
+class LogSampler(logging.Filter):
+    """Samples INFO and below by message template, falling back to logger name."""
+
+    def __init__(self, rules, keep_traced=True):
+        super().__init__()
+        self.rules = {key: SampleRule(key, **rule) for key, rule in rules.items()}
+        self.keep_traced = keep_traced
+
+    def filter(self, record):
+        if not self.rules or record.levelno >= logging.WARNING:
+            return True
+        rule = self.rules.get(record.msg) if isinstance(record.msg, str) else None
+        if rule is None:
+            rule = self.rules.get(record.name)
+            if rule is None:
+                return True
+        if self.keep_traced:
+            # runs after TraceContextFilter, records from sampled traces are always kept
+            ctx = getattr(record, "_span_context", None)
+            if ctx is not None and ctx.trace_flags.sampled:
+                return True
+        if rule.allow():
+            return True
+        rule.suppressed.inc()
+        return False
+
+formatter = TraceJsonFormatter('%(asctime)s %(name)s %(levelname)s %(message)s trace_id=%(trace_id)s span_id=%(span_id)s')
+
+def setup_logging(logger, log_path, sampling=True):
+    """Attaches the queued file/stderr handler to `logger` and returns it, so shutdown can close it."""
+    os.makedirs(os.path.dirname(log_path), exist_ok=True)
+    file_handler = RotatingLogFile(log_path)
+    file_handler.setFormatter(formatter)
+    handler = QueuedLogHandler([file_handler, logging.StreamHandler()])
+    handler.addFilter(TraceContextFilter())
+    if sampling:
+        handler.addFilter(LogSampler(LOG_SAMPLING, keep_traced=LOG_SAMPLING_KEEP_TRACED))
+    logger.addHandler(handler)
+    logger.setLevel(logging.INFO)
+    return handler
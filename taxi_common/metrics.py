@@ -0,0 +1,143 @@
+# taxi_common/metrics.py
+import anyio.to_thread
+import asyncio
+import contextvars
+import cProfile
+import functools
+import os
+import time
+from fastapi.routing import APIRoute
+from starlette.concurrency import run_in_threadpool
+from prometheus_client import Counter, Gauge, Histogram
+from opentelemetry import trace
+from .profiling import profile_request, save_profile
+
+REQUEST_COUNT = Counter("http_requests_total", "HTTP requests", ["method", "route", "status"])
+REQUEST_LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ["method", "route"])
+# gauges are summed over live workers when running under gunicorn with PROMETHEUS_MULTIPROC_DIR
+REQUESTS_IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests currently being served", multiprocess_mode="livesum")
+THREADPOOL_SIZE = Gauge("threadpool_size", "Worker threads available to sync handlers", multiprocess_mode="livesum")
+THREADPOOL_BUSY = Gauge("threadpool_busy_threads", "Worker threads running sync handlers", multiprocess_mode="livesum")
+THREADPOOL_WAITING = Gauge("threadpool_waiting_tasks", "Sync handlers queued for a worker thread", multiprocess_mode="livesum")
+THREADPOOL_QUEUE_DEPTH = Histogram("threadpool_queue_depth", "Sync handlers queued for a worker thread, sampled by the loop monitor",
+                                   buckets=(0, 1, 2, 5, 10, 20, 50, 100, 200, 500))
+THREADPOOL_WAIT = Histogram("threadpool_wait_seconds", "Time sync handlers waited for a worker thread", ["route"],
+                            buckets=(.0001, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1))
+TIME_TO_HANDLER = Histogram("request_time_to_handler_seconds", "Time from request arrival to the endpoint starting", ["route"],
+                            buckets=(.0001, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1))
+EVENT_LOOP_LAG = Histogram("event_loop_lag_seconds", "How late the event loop woke the lag monitor",
+                           buckets=(.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+request_started = contextvars.ContextVar("request_started", default=None)
+loop_lag = 0.0
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+        # labelled children are cached so the hot path skips the registry lock
+        self.children = {}
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        REQUESTS_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        started = request_started.set(start)
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            request_started.reset(started)
+            elapsed = time.perf_counter() - start
+            REQUESTS_IN_FLIGHT.dec()
+            route = scope.get("route")
+            key = (scope["method"], route.path if route else "unmatched", status)
+            children = self.children.get(key)
+            if children is None:
+                children = self.children[key] = (REQUEST_COUNT.labels(*key), REQUEST_LATENCY.labels(*key[:2]))
+            children[0].inc()
+            children[1].observe(elapsed)
+
+def record_handler_start(time_to_handler, started, attributes=None):
+    arrived = request_started.get()
+    if arrived is None:
+        return
+    time_to_handler.observe(started - arrived)
+    span = trace.get_current_span()
+    if span.is_recording():
+        span.set_attribute("request.time_to_handler_ms", (started - arrived) * 1000)
+        span.set_attribute("event_loop.lag_ms", loop_lag * 1000)
+        if attributes:
+            span.set_attributes(attributes)
+
+def instrumented(endpoint, route):
+    time_to_handler = TIME_TO_HANDLER.labels(route)
+    # cProfile hooks the calling thread, so sync endpoints are profiled inside their worker thread
+    if asyncio.iscoroutinefunction(endpoint):
+        @functools.wraps(endpoint)
+        async def async_wrapper(*args, **kwargs):
+            record_handler_start(time_to_handler, time.perf_counter())
+            holder = profile_request.get()
+            if holder is None:
+                return await endpoint(*args, **kwargs)
+            profiler = cProfile.Profile()
+            profiler.enable()
+            try:
+                return await endpoint(*args, **kwargs)
+            finally:
+                profiler.disable()
+                holder["id"] = save_profile(profiler)
+        return async_wrapper
+
+    threadpool_wait = THREADPOOL_WAIT.labels(route)
+
+    def call(queued, submitted, args, kwargs):
+        started = time.perf_counter()
+        threadpool_wait.observe(started - submitted)
+        record_handler_start(time_to_handler, started,
+                             {"threadpool.queue_depth": queued, "threadpool.wait_ms": (started - submitted) * 1000})
+        holder = profile_request.get()
+        if holder is None:
+            return endpoint(*args, **kwargs)
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return endpoint(*args, **kwargs)
+        finally:
+            profiler.disable()
+            holder["id"] = save_profile(profiler)
+
+    # dispatching to the threadpool here instead of in FastAPI is what makes the queue wait visible
+    @functools.wraps(endpoint)
+    async def wrapper(*args, **kwargs):
+        queued = anyio.to_thread.current_default_thread_limiter().statistics().tasks_waiting
+        return await run_in_threadpool(call, queued, time.perf_counter(), args, kwargs)
+    return wrapper
+
+class InstrumentedRoute(APIRoute):
+    def __init__(self, path, endpoint, **kwargs):
+        super().__init__(path, instrumented(endpoint, path), **kwargs)
+
+async def monitor_event_loop():
+    global loop_lag
+    loop = asyncio.get_running_loop()
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        loop_lag = max(0.0, loop.time() - start - LOOP_LAG_INTERVAL)
+        EVENT_LOOP_LAG.observe(loop_lag)
+        waiting = limiter.statistics().tasks_waiting
+        THREADPOOL_QUEUE_DEPTH.observe(waiting)
+        # set on the tick rather than with set_function, which multiprocess mode cannot collect
+        THREADPOOL_SIZE.set(limiter.total_tokens)
+        THREADPOOL_BUSY.set(limiter.borrowed_tokens)
+        THREADPOOL_WAITING.set(waiting)
@@ -0,0 +1,117 @@
+# taxi_common/partitions.py
+"""Keeps the monthly partitions of rides going on a running system.
+
+db/init.sql creates the partitioned table, the current month and the next
+three. One worker of each service with a database (slot 0) also runs
+maintain_partitions on a thread every PARTITION_MAINTENANCE_INTERVAL seconds:
+- create RIDES_PARTITIONS_AHEAD months past the current one
+- with RIDES_RETENTION_MONTHS set, detach the months older than that, and
+  drop them only with RIDES_DROP_EXPIRED
+An advisory lock lets one process at a time do the work and the rest skip it.
+There is no default partition, so every round also reports how many months
+ahead exist; inserts fail once the current month runs out.
+"""
+import os
+import psycopg2
+from prometheus_client import Gauge
+from .db import DB_HOST, DB_NAME, DB_PASS, DB_USER
+
+PARTITION_MAINTENANCE_INTERVAL = float(os.getenv("PARTITION_MAINTENANCE_INTERVAL", "3600"))
+RIDES_PARTITIONS_AHEAD = int(os.getenv("RIDES_PARTITIONS_AHEAD", "3"))
+# off by default, rides are history; detached months stay on disk as rides_YYYY_MM tables
+RIDES_RETENTION_MONTHS = int(os.getenv("RIDES_RETENTION_MONTHS", "0"))
+RIDES_DROP_EXPIRED = os.getenv("RIDES_DROP_EXPIRED", "false").lower() in ("1", "true", "yes")
+# fewer months ahead than this is logged as an error every round
+RIDES_PARTITIONS_MIN_AHEAD = int(os.getenv("RIDES_PARTITIONS_MIN_AHEAD", "1"))
+# DDL waits for this long behind other locks on rides, then gives up until the next round
+PARTITION_LOCK_TIMEOUT = os.getenv("PARTITION_LOCK_TIMEOUT", "5s")
+# any number, as long as nothing else takes the same advisory lock
+MAINTENANCE_LOCK = 0x72696465
+
+RIDE_PARTITIONS_AHEAD = Gauge("ride_partitions_ahead", "Monthly rides partitions that exist past the current month",
+                              multiprocess_mode="livemax")
+
+PARTITION_UPPER_BOUND = "(regexp_match(pg_get_expr(c.relpartbound, c.oid), 'TO \\(''([^'']+)''\\)'))[1]::timestamp"
+
+EXPIRED_PARTITIONS = """
+    SELECT c.oid::regclass::text, i.inhdetachpending
+    FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = 'rides'::regclass
+      AND """ + PARTITION_UPPER_BOUND + """ <= date_trunc('month', LOCALTIMESTAMP) - make_interval(months => %s)
+"""
+
+# whole months between the current one and the end of the last attached partition
+MONTHS_AHEAD = """
+    SELECT (extract(year FROM end_month) * 12 + extract(month FROM end_month)
+            - extract(year FROM LOCALTIMESTAMP) * 12 - extract(month FROM LOCALTIMESTAMP))::int - 1
+    FROM (SELECT MAX(""" + PARTITION_UPPER_BOUND + """) AS end_month
+          FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+          WHERE i.inhparent = 'rides'::regclass AND NOT i.inhdetachpending) bounds
+"""
+
+def connect():
+    conn = psycopg2.connect(host=DB_HOST, dbname=DB_NAME, user=DB_USER, password=DB_PASS)
+    conn.autocommit = True
+    return conn
+
+def maintain_partitions():
+    """One round of maintenance; returns (months created, partitions detached), or None if another process holds the lock."""
+    # its own connection rather than a pooled one: DETACH CONCURRENTLY has to run outside a transaction
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT pg_try_advisory_lock(%s)", (MAINTENANCE_LOCK,))
+            if not cur.fetchone()[0]:
+                return None
+            cur.execute("SET lock_timeout = %s", (PARTITION_LOCK_TIMEOUT,))
+            cur.execute("SELECT create_ride_partitions(LOCALTIMESTAMP, LOCALTIMESTAMP + make_interval(months => %s))",
+                        (RIDES_PARTITIONS_AHEAD,))
+            created = cur.fetchone()[0]
+            detached = []
+            if RIDES_RETENTION_MONTHS > 0:
+                cur.execute(EXPIRED_PARTITIONS, (RIDES_RETENTION_MONTHS,))
+                for partition, detach_pending in cur.fetchall():
+                    # CONCURRENTLY doesn't block queries on rides; FINALIZE completes one that was interrupted
+                    cur.execute(f"ALTER TABLE rides DETACH PARTITION {partition} {'FINALIZE' if detach_pending else 'CONCURRENTLY'}")
+                    if RIDES_DROP_EXPIRED:
+                        cur.execute(f"DROP TABLE {partition}")
+                    detached.append(partition)
+                if detached:
+                    # lookups by id only find rides through ride_routes; these no longer lead anywhere
+                    cur.execute("DELETE FROM ride_routes WHERE requested_at < date_trunc('month', LOCALTIMESTAMP) - make_interval(months => %s)",
+                                (RIDES_RETENTION_MONTHS,))
+        return created, detached
+    finally:
+        # also releases the advisory lock
+        conn.close()
+
+def months_ahead():
+    conn = connect()
+    try:
+        with conn.cursor() as cur:
+            cur.execute(MONTHS_AHEAD)
+            months = cur.fetchone()[0]
+    finally:
+        conn.close()
+    # no partitions at all counts as the current month missing too
+    return -1 if months is None else months
+
+def run_partition_maintenance(logger, stopping):
+    while True:
+        try:
+            done = maintain_partitions()
+            if done and (done[0] or done[1]):
+                logger.info("Created %s ride partitions, %s %s", done[0], "dropped" if RIDES_DROP_EXPIRED else "detached",
+                            ", ".join(done[1]) or "none")
+        except Exception:
+            logger.warning("Ride partition maintenance failed, retrying next round", exc_info=True)
+        # checked whoever held the lock, and even if creating failed: running out is what breaks inserts
+        try:
+            ahead = months_ahead()
+            RIDE_PARTITIONS_AHEAD.set(ahead)
+            if ahead < RIDES_PARTITIONS_MIN_AHEAD:
+                logger.error("Only %s ride partitions exist past the current month; inserts fail once they run out", ahead)
+        except Exception:
+            logger.warning("Could not count ride partitions ahead", exc_info=True)
+        if stopping.wait(PARTITION_MAINTENANCE_INTERVAL):
+            return
@@ -0,0 +1,154 @@
+# taxi_common/profiling.py
+import collections
+import concurrent.futures.thread
+import contextvars
+import hmac
+import os
+import pstats
+import selectors
+import sys
+import threading
+import time
+import uuid
+from prometheus_client import Counter
+from opentelemetry import trace
+
+# the middleware is only wired in when PROFILE_TOKEN is set
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN")
+PROFILE_DIR = os.getenv("PROFILE_DIR", "/tmp/profiles")
+# for the whole service; under gunicorn each worker gets an even share
+PROFILE_MAX_PER_MINUTE = float(os.getenv("PROFILE_MAX_PER_MINUTE", "6"))
+REQUEST_PROFILES = Counter("request_profiles_total", "Requests that asked to be profiled", ["outcome"])
+profile_request = contextvars.ContextVar("profile_request", default=None)
+
+def save_profile(profiler):
+    ctx = trace.get_current_span().get_span_context()
+    profile_id = format(ctx.trace_id, "032x") if ctx.is_valid else uuid.uuid4().hex
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, profile_id)
+    # .prof loads into snakeviz, flameprof or gprof2dot; .txt is the call tree for a quick look
+    profiler.dump_stats(path + ".prof")
+    with open(path + ".txt", "w") as f:
+        stats = pstats.Stats(profiler, stream=f).sort_stats("cumulative")
+        stats.print_stats(50)
+        stats.print_callees(20)
+    return profile_id
+
+class ProfileMiddleware:
+    """Profiles requests sent with `X-Profile: <PROFILE_TOKEN>`, one at a time per worker and at most PROFILE_MAX_PER_MINUTE."""
+
+    def __init__(self, app):
+        self.app = app
+        self.token = PROFILE_TOKEN.encode()
+        # built on the first request, so in the worker, after gunicorn's post_fork has set WORKER_COUNT
+        self.per_minute = PROFILE_MAX_PER_MINUTE / int(os.getenv("WORKER_COUNT", "1"))
+        self.allowance = 1.0
+        self.updated = time.monotonic()
+        self.active = False
+
+    def requested(self, scope):
+        for name, value in scope["headers"]:
+            if name == b"x-profile":
+                return hmac.compare_digest(value, self.token)
+        return False
+
+    def allow(self):
+        # token bucket of one; runs on the event loop so needs no lock
+        now = time.monotonic()
+        self.allowance = min(1.0, self.allowance + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+        if self.active or self.allowance < 1:
+            return False
+        self.allowance -= 1
+        return True
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.requested(scope):
+            await self.app(scope, receive, send)
+            return
+        if not self.allow():
+            REQUEST_PROFILES.labels("rate_limited").inc()
+            await self.app(scope, receive, send)
+            return
+        holder = {}
+
+        async def send_with_profile_id(message):
+            if message["type"] == "http.response.start" and "id" in holder:
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", holder["id"].encode())]
+            await send(message)
+
+        self.active = True
+        reset = profile_request.set(holder)
+        try:
+            await self.app(scope, receive, send_with_profile_id)
+        finally:
+            profile_request.reset(reset)
+            self.active = False
+        REQUEST_PROFILES.labels("captured").inc()
+
+class StackSampler:
+    """Counts every thread's stack STACK_SAMPLER_HZ times a second for collapsed-stack flamegraphs."""
+
+    # threads parked on a lock, in the event loop's select or waiting for executor work are idle, not interesting.
+    # Executor threads block in a C-level SimpleQueue.get, so _worker itself is the top frame; anyio's worker
+    # threads wait in queue.Queue.get, which parks in Condition.wait
+    IDLE = {threading.Condition.wait.__code__, threading.Event.wait.__code__, selectors.DefaultSelector.select.__code__,
+            concurrent.futures.thread._worker.__code__}
+
+    def __init__(self, hz, max_stacks):
+        self.interval = 1.0 / hz
+        self.max_stacks = max_stacks
+        self.stacks = collections.Counter()
+        self.truncated = 0
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.run, name="stack-sampler", daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        own = threading.get_ident()
+        deadline = time.monotonic()
+        while True:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            samples = []
+            for ident, frame in sys._current_frames().items():
+                if ident == own or frame.f_code in self.IDLE:
+                    continue
+                # keyed by code objects; rendering to strings waits until someone asks
+                codes = []
+                while frame is not None:
+                    codes.append(frame.f_code)
+                    frame = frame.f_back
+                codes.append(names.get(ident, "thread"))
+                samples.append(tuple(codes))
+            with self.lock:
+                for key in samples:
+                    if key in self.stacks or len(self.stacks) < self.max_stacks:
+                        self.stacks[key] += 1
+                    else:
+                        self.truncated += 1
+            deadline += self.interval
+            delay = deadline - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                deadline = time.monotonic()
+
+    def collapsed(self, reset=False):
+        with self.lock:
+            stacks, truncated = self.stacks, self.truncated
+            if reset:
+                self.stacks, self.truncated = collections.Counter(), 0
+            else:
+                stacks = stacks.copy()
+        lines = []
+        for key, count in stacks.items():
+            frames = [key[-1]] + [f"{os.path.basename(code.co_filename)}:{code.co_name}" for code in reversed(key[:-1])]
+            lines.append(f"{';'.join(frames)} {count}")
+        if truncated:
+            lines.append(f"[truncated] {truncated}")
+        return "\n".join(lines) + "\n"
+
+STACK_SAMPLER_HZ = float(os.getenv("STACK_SAMPLER_HZ", "0"))
+STACK_SAMPLER_MAX_STACKS = int(os.getenv("STACK_SAMPLER_MAX_STACKS", "10000"))
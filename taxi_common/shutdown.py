@@ -0,0 +1,38 @@
+# taxi_common/shutdown.py
+import asyncio
+import os
+import signal
+import time
+import anyio.to_thread
+
+# SIGTERM -> /readyz fails -> SHUTDOWN_DELAY for load balancers to notice -> listeners close and
+# in-flight requests get DRAIN_TIMEOUT -> lifespan shutdown waits for handler threads, then flushes.
+# All of it has to fit in gunicorn's graceful_timeout (and the container's stop grace period).
+SHUTDOWN_DELAY = float(os.getenv("SHUTDOWN_DELAY", "0"))
+DRAIN_TIMEOUT = float(os.getenv("DRAIN_TIMEOUT", "20"))
+THREAD_DRAIN_TIMEOUT = float(os.getenv("THREAD_DRAIN_TIMEOUT", "5"))
+
+def flip_readiness_on_sigterm(app):
+    """Wraps the server's SIGTERM handler so readiness fails before the server stops listening."""
+    previous = signal.getsignal(signal.SIGTERM)
+    if not callable(previous):
+        return
+    loop = asyncio.get_running_loop()
+
+    def handle(signum, frame):
+        app.state.ready = False
+        if SHUTDOWN_DELAY > 0:
+            loop.call_soon_threadsafe(loop.call_later, SHUTDOWN_DELAY, previous, signum, frame)
+        else:
+            previous(signum, frame)
+
+    signal.signal(signal.SIGTERM, handle)
+
+async def drain_threads():
+    # requests the server gave up on are cancelled on the loop, but their sync handlers keep
+    # running in worker threads; the pool and log queues have to outlive them
+    limiter = anyio.to_thread.current_default_thread_limiter()
+    deadline = time.monotonic() + THREAD_DRAIN_TIMEOUT
+    while limiter.borrowed_tokens and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    return limiter.borrowed_tokens
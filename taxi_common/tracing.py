@@ -0,0 +1,82 @@
+# taxi_common/tracing.py
+import os
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import SpanProcessor, TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor
+from opentelemetry.sdk.trace.sampling import Decision, Sampler, SamplingResult
+from opentelemetry.trace import SpanContext, StatusCode, TraceFlags
+
+# jaeger, otlp or none; none skips the SDK and instrumentation entirely
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "jaeger")
+# head sampling comes from the SDK's OTEL_TRACES_SAMPLER / OTEL_TRACES_SAMPLER_ARG,
+# batching from OTEL_BSP_MAX_QUEUE_SIZE, OTEL_BSP_MAX_EXPORT_BATCH_SIZE and OTEL_BSP_SCHEDULE_DELAY
+TRACE_KEEP_ERRORS = os.getenv("TRACE_KEEP_ERRORS", "false").lower() == "true"
+
+class RecordUnsampledSampler(Sampler):
+    """Records the spans the wrapped sampler drops, so ErrorSpanProcessor can still export failures."""
+
+    def __init__(self, sampler):
+        self.sampler = sampler
+
+    def should_sample(self, parent_context, trace_id, name, kind=None, attributes=None, links=None, trace_state=None):
+        result = self.sampler.should_sample(parent_context, trace_id, name, kind, attributes, links, trace_state)
+        if result.decision is Decision.DROP:
+            return SamplingResult(Decision.RECORD_ONLY, result.attributes, result.trace_state)
+        return result
+
+    def get_description(self):
+        return f"RecordUnsampled{{{self.sampler.get_description()}}}"
+
+class SampledSpan:
+    def __init__(self, span):
+        self.span = span
+        ctx = span.context
+        self.context = SpanContext(ctx.trace_id, ctx.span_id, ctx.is_remote, TraceFlags(TraceFlags.SAMPLED), ctx.trace_state)
+
+    def __getattr__(self, name):
+        return getattr(self.span, name)
+
+class ErrorSpanProcessor(SpanProcessor):
+    """Passes sampled spans through and promotes unsampled spans that ended in error."""
+
+    def __init__(self, processor):
+        self.processor = processor
+
+    def on_end(self, span):
+        if span.context.trace_flags.sampled:
+            self.processor.on_end(span)
+        elif span.status.status_code is StatusCode.ERROR:
+            self.processor.on_end(SampledSpan(span))
+
+    def shutdown(self):
+        self.processor.shutdown()
+
+    def force_flush(self, timeout_millis=30000):
+        return self.processor.force_flush(timeout_millis)
+
+def instrument(app):
+    # imported only when tracing is on; the instrumentor pulls in pkg_resources
+    if TRACE_EXPORTER != "none":
+        from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
+        FastAPIInstrumentor.instrument_app(app, excluded_urls="metrics,healthz,readyz")
+
+def setup_tracing(service_name):
+    """Installs the global tracer provider; spans started before this go through the SDK's proxy as no-ops."""
+    if TRACE_EXPORTER == "none":
+        return None
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    if TRACE_KEEP_ERRORS:
+        provider.sampler = RecordUnsampledSampler(provider.sampler)
+    # exporters are imported here, in lifespan, the OTLP one costs ~100ms of protobuf imports
+    if TRACE_EXPORTER == "otlp":
+        # endpoint from OTEL_EXPORTER_OTLP_TRACES_ENDPOINT
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        span_exporter = OTLPSpanExporter()
+    else:
+        from opentelemetry.exporter.jaeger.thrift import JaegerExporter
+        span_exporter = JaegerExporter(collector_endpoint=os.getenv("JAEGER_COLLECTOR", "http://jaeger:14268/api/traces"))
+    span_processor = BatchSpanProcessor(span_exporter)
+    provider.add_span_processor(ErrorSpanProcessor(span_processor) if TRACE_KEEP_ERRORS else span_processor)
+    trace.set_tracer_provider(provider)
+    return provider
@@ -0,0 +1,8 @@
+# taxi_common/workers.py
+from uvicorn.workers import UvicornWorker
+from .shutdown import DRAIN_TIMEOUT
+
+class DrainingWorker(UvicornWorker):
+    # UvicornWorker leaves uvicorn's drain unbounded, so a slow client kept it waiting until gunicorn's
+    # graceful_timeout SIGKILLed the worker and lifespan shutdown (log and span flushing) never ran
+    CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "timeout_graceful_shutdown": DRAIN_TIMEOUT}
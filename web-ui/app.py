@@ -1,41 +1,27 @@
 # web-ui/app.py
-from fastapi import FastAPI, Request, Form, HTTPException
+from fastapi import Request, Form, HTTPException
 from fastapi.responses import HTMLResponse
 from fastapi.templating import Jinja2Templates
+import asyncio
 import httpx
 import os
 import logging
-from pythonjsonlogger import jsonlogger
-from opentelemetry import trace
-from opentelemetry.instrumentation.fastapi import FastAPIInstrumentor
-from opentelemetry.sdk.resources import Resource
-from opentelemetry.sdk.trace import TracerProvider
-from opentelemetry.sdk.trace.export import BatchSpanProcessor
-from opentelemetry.exporter.jaeger.thrift import JaegerExporter
+from taxi_common.bootstrap import create_app
 
 SERVICE_NAME = "web-ui"
 logger = logging.getLogger(SERVICE_NAME)
 log_dir = os.getenv("LOG_DIR", "/app/logs")
-os.makedirs(log_dir, exist_ok=True)
-log_path = os.path.join(log_dir, "web-ui.log")
-file_handler = logging.FileHandler(log_path)
-formatter = jsonlogger.JsonFormatter('%(asctime)s %(name)s %(levelname)s %(message)s trace_id=%(trace_id)s span_id=%(span_id)s')
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
-logger.addHandler(logging.StreamHandler())
-logger.setLevel(logging.INFO)
+templates = Jinja2Templates(directory="templates")
 
-resource = Resource.create({"service.name": SERVICE_NAME})
-provider = TracerProvider(resource=resource)
-jaeger_exporter = JaegerExporter(collector_endpoint=os.getenv("JAEGER_COLLECTOR", "http://jaeger:14268/api/traces"))
-provider.add_span_processor(BatchSpanProcessor(jaeger_exporter))
-trace.set_tracer_provider(provider)
+def warmup():
+    # compile templates before the first page view rather than during it
+    for name in ("index.html", "driver.html"):
+        templates.get_template(name)
 
-app = FastAPI()
-FastAPIInstrumentor.instrument_app(app)
-templates = Jinja2Templates(directory="templates")
+app = create_app(SERVICE_NAME, os.path.join(log_dir, "web-ui.log"), warmup=warmup)
 
 PASSENGER_API = os.getenv("PASSENGER_API", "http://passenger-service:8001")
+DRIVER_API = os.getenv("DRIVER_API", "http://driver-service:8002")
 
 @app.get("/", response_class=HTMLResponse)
 async def home(request: Request):
@@ -69,3 +55,55 @@ async def ride_status(request: Request, ride_id: int = Form(...)):
         return templates.TemplateResponse("index.html", {"request": request, "result": {"type":"error", "data": r.text}})
     data = r.json()
     return templates.TemplateResponse("index.html", {"request": request, "result": {"type":"status", "data": data}})
+
+async def fetch_json(client, url):
+    # None also when the service is down, so the dashboard renders without that part
+    try:
+        r = await client.get(url, timeout=10)
+    except httpx.HTTPError as e:
+        logger.warning("Failed to fetch %s: %r", url, e)
+        return None
+    if r.status_code != 200:
+        return None
+    return r.json()
+
+async def driver_dashboard(client, driver_id, ride_id):
+    # pending rides and the driver's current ride are independent, fetch both in one round trip
+    available = fetch_json(client, f"{DRIVER_API}/available_rides")
+    if ride_id:
+        rides, current = await asyncio.gather(available, fetch_json(client, f"{PASSENGER_API}/ride_status/{ride_id}"))
+    else:
+        rides, current = await available, None
+    return {"driver_id": driver_id, "ride_id": ride_id, "rides": rides or [], "current": current}
+
+@app.get("/driver", response_class=HTMLResponse)
+async def driver_home(request: Request, driver_id: int = None, ride_id: int = None):
+    async with httpx.AsyncClient() as client:
+        dashboard = await driver_dashboard(client, driver_id, ride_id)
+    return templates.TemplateResponse("driver.html", {"request": request, "dashboard": dashboard, "result": None})
+
+async def driver_action(client, action, done, driver_id, ride_id):
+    # like fetch_json, an unreachable driver-service becomes an error on the page rather than a 500
+    try:
+        r = await client.post(f"{DRIVER_API}/{action}/{ride_id}", params={"driver_id": driver_id}, timeout=10)
+    except httpx.HTTPError as e:
+        logger.error("Failed to %s: %r", action.replace("_", " "), e)
+        return {"type": "error", "data": "Driver service unavailable"}
+    if r.status_code != 200:
+        logger.error("Failed to %s: %s", action.replace("_", " "), r.text)
+        return {"type": "error", "data": r.text}
+    return {"type": done, "data": r.json()}
+
+@app.post("/driver/accept", response_class=HTMLResponse)
+async def driver_accept(request: Request, driver_id: int = Form(...), ride_id: int = Form(...)):
+    async with httpx.AsyncClient() as client:
+        result = await driver_action(client, "accept_ride", "accepted", driver_id, ride_id)
+        dashboard = await driver_dashboard(client, driver_id, ride_id)
+    return templates.TemplateResponse("driver.html", {"request": request, "dashboard": dashboard, "result": result})
+
+@app.post("/driver/complete", response_class=HTMLResponse)
+async def driver_complete(request: Request, driver_id: int = Form(...), ride_id: int = Form(...)):
+    async with httpx.AsyncClient() as client:
+        result = await driver_action(client, "complete_ride", "completed", driver_id, ride_id)
+        dashboard = await driver_dashboard(client, driver_id, ride_id)
+    return templates.TemplateResponse("driver.html", {"request": request, "dashboard": dashboard, "result": result})